@@ -0,0 +1,300 @@
+""" Benchmarks of the main raid analysis paths
+
+Times loading raid nights, the prior-week lookups, parse differentials, full reports and the
+raid_cull season analyses over a raid folder (MyDudes by default), and over a synthetic folder
+of many more nights generated from it. For every benchmark the wall time of several runs is
+recorded, plus the peak memory, retained memory and net allocated blocks of one extra run
+under tracemalloc. Results are written as json, named after the current git commit, and can be
+compared against an earlier results file.
+
+Usage:
+    python benchmark.py [-dir MyDudes] [-synthetic 500] [-repeat 3] [-only complete-report rank-dps]
+                        [-out results.json] [-compare benchmark-results/<commit>.json]
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from os import makedirs, pardir
+from os.path import basename, dirname, isdir, join, realpath
+
+import raid_catalog
+import raid_cull
+import raid_night_summarizer
+import season_aggregate
+from raid_catalog import get_catalog
+from raid_columnar import COLUMNAR_EXTENSION
+from raid_compression import load_json
+from raid_night_summarizer import (RaidnightData, complete_report, differential_parse_dict,
+                                   get_prior_week_data, load_raidnight)
+from raid_stream import load_projected
+
+RESULTS_FOLDER = 'benchmark-results'
+DEFAULT_REPEAT = 3
+DEFAULT_SYNTHETIC_NIGHTS = 500
+
+
+def clear_caches():
+    """
+    Forgets every raidnight, catalog and aggregate held by this process (files on disk are kept)
+    """
+    raid_night_summarizer._loaded_raidnights.clear()
+    raid_catalog._catalogs.clear()
+    season_aggregate._aggregates.clear()
+
+
+def make_synthetic_folder(source_folder, nights, target_root, full=False):
+    """
+    Writes a raid folder of many nights, made by copying the nights of source_folder with new codes
+
+    Each pass over the source nights is shifted forward by the length of the source season, so
+    the copies form consecutive seasons with realistic lockouts and prior weeks.
+
+    Parameters:
+        source_folder (str): the raid folder to copy nights from
+        nights (int): the number of nights to write
+        target_root (str): the folder the new raid folder is made in; zones.json and
+            raid-release-dates.json are copied next to it
+        full (bool): copy the full wcl tables instead of only the fields the summarizer uses
+
+    Returns:
+        str: the path of the new raid folder
+    """
+    for filename in ['zones.json', 'raid-release-dates.json']:
+        shutil.copy(join(source_folder, pardir, filename), join(target_root, filename))
+    raid_folder = join(target_root, basename(realpath(source_folder)) + '-synthetic')
+    makedirs(raid_folder)
+
+    catalog = get_catalog(source_folder)
+    codes = [code for code in catalog.codes() if not catalog.entries[code]['filename'].endswith(COLUMNAR_EXTENSION)]
+    lockouts = [catalog.entries[code]['lockout'] for code in codes if catalog.entries[code]['lockout'] is not None]
+    season_weeks = max(lockouts) - min(lockouts) + 1 if lockouts else 1
+
+    for night in range(nights):
+        code = codes[night % len(codes)]
+        shift_seconds = (night // len(codes)) * season_weeks * 7 * 24 * 60 * 60
+        source_path = catalog.path(code)
+        if full:
+            file_dict = load_json(source_path)
+        else:
+            file_dict = load_projected(source_path)
+        file_dict['fights']['start'] += shift_seconds * 1000
+        file_dict['fights']['end'] += shift_seconds * 1000
+        file_dict['raidnight-date'] += shift_seconds
+
+        new_code = f'syn{night:05d}{code[:8]}'
+        date_string = datetime.date.fromtimestamp(file_dict['fights']['start']//1000).strftime("%y-%m-%d")
+        name = catalog.entries[code]['name'][:-len(date_string)] + date_string
+        with open(join(raid_folder, f'{name}({new_code}).json'), 'w') as open_file:
+            json.dump(file_dict, open_file, indent=4)
+    return raid_folder
+
+
+def _folder_codes(raid_folder):
+    return get_catalog(raid_folder).codes()
+
+
+def _loaded_nights(raid_folder):
+    raidnights = [load_raidnight(code, raid_folder) for code in _folder_codes(raid_folder)]
+    for raidnight in raidnights:
+        raidnight.clear_analysis_cache()
+    return raidnights
+
+
+def _lockout_nights(raid_folder):
+    # raid_cull needs a lockout for every night
+    catalog = get_catalog(raid_folder)
+    return [raidnight for raidnight in _loaded_nights(raid_folder)
+            if catalog.entries[raidnight.wcl_string]['lockout'] is not None]
+
+
+def _load_every_night(raid_folder):
+    for code in _folder_codes(raid_folder):
+        RaidnightData(code, raid_folder)
+
+
+def _prior_weeks(state):
+    raid_folder, raidnights = state
+    # the prior nights are loaded from disk again, as in a fresh process
+    raid_night_summarizer._loaded_raidnights.clear()
+    for raidnight in raidnights:
+        get_prior_week_data(raidnight, raid_folder)
+
+
+def _differentials(state):
+    raid_folder, raidnights = state
+    for raidnight in raidnights:
+        differential_parse_dict(raidnight, raid_folder)
+
+
+def _reports(state):
+    raid_folder, raidnights, report_folder = state
+    try:
+        for raidnight in raidnights:
+            complete_report(raidnight, raid_folder, join(report_folder, raidnight.wcl_string + '.txt'),
+                            raidnight.wcl_string)
+    finally:
+        shutil.rmtree(report_folder)
+
+
+def _report_state(raid_folder):
+    report_folder = tempfile.mkdtemp(prefix='benchmark-reports-')
+    return raid_folder, _loaded_nights(raid_folder), report_folder
+
+
+# benchmark name: (setup(raid_folder) -> state, run(state)); only run is measured
+benchmarks = {'raidnight-load': (lambda raid_folder: raid_folder, _load_every_night),
+              'prior-week-data': (lambda raid_folder: (raid_folder, _loaded_nights(raid_folder)), _prior_weeks),
+              'differential-parse-dict': (lambda raid_folder: (raid_folder, _loaded_nights(raid_folder)), _differentials),
+              'complete-report': (_report_state, _reports),
+              'all-ilvl-parses-df': (_lockout_nights, raid_cull.all_ilvl_parses_df),
+              'rank-dps': (_loaded_nights, raid_cull.rank_dps)}
+
+
+def measure(setup, run, raid_folder, repeat=DEFAULT_REPEAT):
+    """
+    Times repeat runs of a benchmark, then measures memory during one more run under tracemalloc
+
+    Every run starts from a fresh setup with the process caches cleared, so runs are comparable.
+    Anything the benchmark prints is discarded.
+
+    Returns:
+        dict: wall_seconds (every run), min_seconds, median_seconds, peak_memory_bytes,
+            net_memory_bytes and net_allocated_blocks
+    """
+    wall_seconds = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            clear_caches()
+            state = setup(raid_folder)
+            start = time.perf_counter()
+            run(state)
+            wall_seconds.append(time.perf_counter() - start)
+
+        clear_caches()
+        state = setup(raid_folder)
+        blocks_before = sys.getallocatedblocks()
+        tracemalloc.start()
+        run(state)
+        net_memory, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        net_blocks = sys.getallocatedblocks() - blocks_before
+
+    return {'wall_seconds': wall_seconds,
+            'min_seconds': min(wall_seconds),
+            'median_seconds': statistics.median(wall_seconds),
+            'peak_memory_bytes': peak_memory,
+            'net_memory_bytes': net_memory,
+            'net_allocated_blocks': net_blocks}
+
+
+def run_suite(raid_folder, names, repeat=DEFAULT_REPEAT):
+    """
+    Returns:
+        dict: nights (the number of raid files) and results ({benchmark name: measurements})
+    """
+    clear_caches()
+    # index the folder before timing anything; the catalog is saved next to the raid files
+    with contextlib.redirect_stdout(io.StringIO()):
+        get_catalog(raid_folder)
+    results = dict()
+    for name in names:
+        setup, run = benchmarks[name]
+        results[name] = measure(setup, run, raid_folder, repeat)
+        print(f"  {name:<26}{results[name]['median_seconds']:>10.3f}s"
+              f"{results[name]['peak_memory_bytes']/1e6:>10.1f}MB peak")
+    return {'nights': len(_folder_codes(raid_folder)), 'results': results}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=dirname(realpath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Prints the median time and peak memory of every benchmark relative to an earlier results file
+    """
+    for folder_label, folder_results in results['folders'].items():
+        baseline_folder = baseline.get('folders', dict()).get(folder_label)
+        if not baseline_folder:
+            continue
+        print(f"{folder_label}: compared with {baseline.get('commit')}")
+        for name, measured in folder_results['results'].items():
+            before = baseline_folder['results'].get(name)
+            if not before:
+                continue
+            time_ratio = measured['median_seconds'] / before['median_seconds'] if before['median_seconds'] else float('nan')
+            memory_ratio = (measured['peak_memory_bytes'] / before['peak_memory_bytes']
+                            if before['peak_memory_bytes'] else float('nan'))
+            print(f"  {name:<26}{time_ratio:>8.2f}x time{memory_ratio:>8.2f}x peak memory")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the raid analysis paths')
+    parser.add_argument('-dir', type=str, default='MyDudes',
+                        help="the raid folder used as fixtures (default: MyDudes)")
+    parser.add_argument('-synthetic', type=int, default=DEFAULT_SYNTHETIC_NIGHTS,
+                        help="the number of nights in the synthetic folder, 0 to skip it (default: 500)")
+    parser.add_argument('-full', action='store_true',
+                        help="copy the full wcl tables into the synthetic folder (about 2MB per night)")
+    parser.add_argument('-repeat', type=int, default=DEFAULT_REPEAT,
+                        help="the number of timed runs of each benchmark")
+    parser.add_argument('-only', type=str, nargs='+', choices=list(benchmarks),
+                        help="run only these benchmarks")
+    parser.add_argument('-out', type=str,
+                        help="the results file (default: benchmark-results/<git commit>.json)")
+    parser.add_argument('-compare', type=str,
+                        help="an earlier results file to compare against")
+    args = parser.parse_args()
+
+    basedir = dirname(realpath(__file__))
+    raid_folder = args.dir if isdir(args.dir) else join(basedir, args.dir)
+    names = args.only if args.only else list(benchmarks)
+    commit = _git_commit()
+
+    results = {'commit': commit,
+               'date': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'repeat': args.repeat,
+               'folders': dict()}
+
+    print(f'{raid_folder}:')
+    results['folders']['fixtures'] = run_suite(raid_folder, names, args.repeat)
+
+    if args.synthetic:
+        target_root = tempfile.mkdtemp(prefix='benchmark-')
+        try:
+            synthetic_folder = make_synthetic_folder(raid_folder, args.synthetic, target_root, args.full)
+            print(f'synthetic folder of {args.synthetic} nights:')
+            results['folders']['synthetic'] = run_suite(synthetic_folder, names, args.repeat)
+        finally:
+            clear_caches()
+            shutil.rmtree(target_root)
+
+    out_path = args.out
+    if not out_path:
+        if not isdir(join(basedir, RESULTS_FOLDER)):
+            makedirs(join(basedir, RESULTS_FOLDER))
+        out_path = join(basedir, RESULTS_FOLDER, f"{commit or 'results'}.json")
+    with open(out_path, 'w') as open_file:
+        json.dump(results, open_file, indent=4)
+    print(f'results written to {out_path}')
+
+    if args.compare:
+        with open(args.compare, 'r') as open_file:
+            compare(results, json.load(open_file))
@@ -1,38 +1,116 @@
-import certifi
-from io import BytesIO
-import json
+from collections import deque
+import os
+import re
+import threading
+import time
 import requests
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
+from os.path import join
+from wcl_cache import CACHE_FOLDER, ResponseCache
 
-def get_wcl_api_table(fightstring, mode="requests"):
-    base_tables_url = "https://www.warcraftlogs.com:443/v1/report/tables/"
-    url = ''.join([base_tables_url, fightstring])
+# root of the wcl v1 report api; point this (or the WCL_REPORT_URL environment variable)
+# at a local server such as wcl_stub to run without warcraftlogs.com
+WCL_REPORT_URL = os.environ.get('WCL_REPORT_URL', "https://www.warcraftlogs.com:443/v1/report/")
+
+# one keep-alive session is shared by every call; its pool grows to match the fetch concurrency
+DEFAULT_POOL_SIZE = 8
+REQUEST_TIMEOUT = 30
+# the number of most recent requests request_timings keeps
+REQUEST_TIMINGS_KEPT = 10000
+
+# (url without api_key, status code, seconds) for the most recent requests, for profiling ingestion
+request_timings = deque(maxlen=REQUEST_TIMINGS_KEPT)
+
+# a wcl_replay.Cassette to record responses to, or replay them from, instead of only using the network
+cassette = None
+
+# a wcl_cache.ResponseCache the responses are saved in and reused from (see use_response_cache)
+response_cache = None
+
+_session = None
+_session_pool_size = 0
+_session_lock = threading.Lock()
+
+def get_session(pool_size=DEFAULT_POOL_SIZE):
+    '''
+    Returns the shared requests session, rebuilt if a larger connection pool is needed
+
+    Parameters:
+        pool_size (int): the number of connections that may be open to wcl at once
+    '''
+    global _session, _session_pool_size
+    with _session_lock:
+        if _session is None or pool_size > _session_pool_size:
+            retries = Retry(total=5,
+                            backoff_factor=0.5,
+                            status_forcelist=[ 429, 500, 502, 503, 504 ])
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+
+            s = requests.Session()
+            s.mount('https://', adapter)
+            s.mount('http://', adapter)
+
+            if _session is not None:
+                # release the smaller pool's connections
+                _session.close()
+            _session = s
+            _session_pool_size = pool_size
+        return _session
 
-    retries = Retry(total=5,
-                    backoff_factor=0.1,
-                    status_forcelist=[ 500, 502, 503, 504 ])
+def use_response_cache(raid_folder, **cache_options):
+    '''
+    Saves and reuses responses in raid_folder's response cache from now on (see wcl_cache)
 
-    s = requests.Session()
-    s.mount('http://', HTTPAdapter(max_retries=retries))
+    Returns:
+        (wcl_cache.ResponseCache): the cache, also kept as get_wcl_api.response_cache
+    '''
+    global response_cache
+    folder = join(raid_folder, CACHE_FOLDER)
+    with _session_lock:
+        if response_cache is None or response_cache.folder != folder:
+            if response_cache is not None:
+                response_cache.flush()
+            response_cache = ResponseCache(folder, **cache_options)
+        return response_cache
 
-    r = s.get(url)
+def flush_response_cache():
+    '''
+    Writes the response cache's index, e.g. once a batch of requests is done
+    '''
+    if response_cache is not None:
+        response_cache.flush()
+
+def _session_get(url, headers=None):
+    return get_session().get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+
+def _cached_get(url):
+    if response_cache is None:
+        return _session_get(url)
+    return response_cache.get(url, _session_get)
+
+def _timed_get(url):
+    start = time.perf_counter()
+    r = cassette.get(url, _cached_get) if cassette is not None else _cached_get(url)
+    request_timings.append((re.sub(r'api_key=[^&]*', 'api_key=', url), r.status_code, time.perf_counter() - start))
+    # never hand an error body back as if it were table data
+    r.raise_for_status()
+    return r
+
+def get_wcl_api_table(fightstring, mode="requests"):
+    base_tables_url = WCL_REPORT_URL + "tables/"
+    url = ''.join([base_tables_url, fightstring])
+
+    r = _timed_get(url)
     return_json = r.json()
-        
+
     return return_json
 
 def get_wcl_api_fights(reportstring, mode="requests"):
-    base_fights_url = "https://www.warcraftlogs.com:443/v1/report/fights/"
+    base_fights_url = WCL_REPORT_URL + "fights/"
     url = ''.join([base_fights_url, reportstring])
 
-    retries = Retry(total=10,
-                    backoff_factor=0.1,
-                    status_forcelist=[ 500, 502, 503, 504 ])
-
-    s = requests.Session()
-    s.mount('http://', HTTPAdapter(max_retries=retries))
-
-    r = s.get(url)
+    r = _timed_get(url)
     return_json = r.json()
 
-    return return_json
\ No newline at end of file
+    return return_json
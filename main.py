@@ -1,16 +1,68 @@
-from raid_night_summarizer import RaidnightData, complete_report, get_best_ilvl_avg_improvement
+from raid_night_summarizer import RaidnightData, load_raidnight, complete_report, get_best_ilvl_avg_improvement
+from raid_catalog import get_catalog
 import argparse
+import contextlib
+import io
+from concurrent.futures import ProcessPoolExecutor
 from os.path import realpath, dirname, join, isdir
 from os import pardir, mkdir
 
+def generate_report(raid_id, raid_folder, basedir, capture=False):
+    '''
+    Writes the text report for one raid code
+
+    The raidnight is loaded once and shared by the report and the most-improved logging.
+    Workers pass capture=True so that reports generated in parallel don't interleave their
+    output; everything printed is then returned instead (None otherwise).
+    '''
+    output = io.StringIO() if capture else None
+    with contextlib.redirect_stdout(output) if capture else contextlib.nullcontext():
+        raidnight = load_raidnight(raid_id, raid_folder)
+        out_path = join(basedir, f'reports/{raidnight.name}.txt')
+
+        complete_report(raidnight, raid_folder, out_path, raid_id, improved=True)
+
+        # optional logging of most-improved raiders
+        print(get_best_ilvl_avg_improvement(raidnight, raid_folder, 5))
+    return output.getvalue() if capture else None
+
+def ingest_missing(raidlist, raid_folder):
+    '''
+    Downloads the reports of raidlist that are not in the raid folder yet, one at a time
+
+    This runs before the process pool starts, so the wcl request rate (see wcl_fetch) and
+    the number of headless browsers stay those of a single ingestion however many workers
+    generate reports.
+
+    Returns:
+        list: the codes whose raid file is in the folder, in raidlist order
+    '''
+    catalog = get_catalog(raid_folder)
+    available = []
+    for raid_id in raidlist:
+        if catalog.find_code(raid_id) is None:
+            try:
+                RaidnightData(raid_id, raid_folder)
+            except Exception as error:
+                print(f'{raid_id}: report failed ({error!r})')
+                continue
+        available.append(raid_id)
+    return available
+
 if __name__ == '__main__':
 
     # Input arguments
     parser = argparse.ArgumentParser(description='Generate reports for warcraftlogs raid data')
-    parser.add_argument('code', type=str, 
-                        help="the 16-character string identifier for a report")
+    parser.add_argument('codes', type=str, nargs='*',
+                        help="the 16-character string identifiers for one or more reports")
     parser.add_argument('-dir', type=str,
                         help="the name of the directory containing raid json files")
+    parser.add_argument('-file', type=str,
+                        help="a file of report codes, one per line")
+    parser.add_argument('-all', action='store_true',
+                        help="generate reports for every raid in the directory")
+    parser.add_argument('-jobs', type=int,
+                        help="the number of reports to generate in parallel (default: one per core)")
     args = parser.parse_args()
 
     # Setup filepaths
@@ -20,14 +72,33 @@ if __name__ == '__main__':
     raid_folder = join(basedir, args.dir if args.dir else 'MyDudes')
 
     # Create list of raid codes to lookup on warcraftlogs
-    raidlist = [args.code]
+    raidlist = list(args.codes)
+    if args.file:
+        with open(args.file, 'r') as open_file:
+            raidlist += [line.strip() for line in open_file if line.strip()]
+    if args.all:
+        raidlist += get_catalog(raid_folder).codes()
+    if not raidlist:
+        parser.error("give at least one report code, -file or -all")
+    # each code once, so no two workers generate the same report
+    raidlist = list(dict.fromkeys(raidlist))
 
     # Generate output file for each raid code
-    for raid_id in raidlist:
-        raidnight = RaidnightData(raid_id, raid_folder)
-        out_path = join(basedir, f'reports/{raidnight.name}.txt')
-
-        complete_report(raidnight, raid_folder, out_path, raid_id, improved=True)
-
-        # optional logging of most-improved raiders
-        print(get_best_ilvl_avg_improvement(raidnight, raid_folder, 5))
\ No newline at end of file
+    if len(raidlist) == 1 or args.jobs == 1:
+        for raid_id in raidlist:
+            try:
+                generate_report(raid_id, raid_folder, basedir)
+            except Exception as error:
+                print(f'{raid_id}: report failed ({error!r})')
+    else:
+        # workers only load raid files: missing reports are downloaded here first, which
+        # also leaves the workers an up to date catalog
+        raidlist = ingest_missing(raidlist, raid_folder)
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [executor.submit(generate_report, raid_id, raid_folder, basedir, capture=True)
+                       for raid_id in raidlist]
+            for raid_id, future in zip(raidlist, futures):
+                try:
+                    print(future.result())
+                except Exception as error:
+                    print(f'{raid_id}: report failed ({error!r})')
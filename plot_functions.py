@@ -1,6 +1,17 @@
-from raid_night_summarizer import *
+from raid_night_summarizer import load_raidnight
+from raid_catalog import get_catalog
+from raid_compression import atomic_write
+import argparse
+import datetime
+import hashlib
+import json
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from concurrent.futures import ProcessPoolExecutor
+from os import makedirs
+from os.path import dirname, isdir, isfile, join, realpath
 import numpy as np
 from textwrap import wrap
 import re
@@ -27,6 +38,16 @@ uldir_ordered_handles = {"Heroic Taloc": 1,
             "Heroic Mythrax": 7,
             "Heroic G'huun": 8}
 
+# boss legend order for each raid-name in the raid catalog
+raid_ordered_handles = {"Antorus_The_Burning_Throne": antorus_ordered_handles,
+                        "Uldir": uldir_ordered_handles}
+
+# charts written by render_dashboard; CHART_VERSION is part of every chart's input signature,
+# so bumping it re-renders everything after a change to the drawing code
+CHART_FORMATS = ('png',)
+CHART_INPUTS_FILENAME = '.chart-inputs.json'
+CHART_VERSION = 1
+
 def get_parse_color(parse_number):
     color_key = [(20, '#9d9d9d'), #common-gray
                 (50, '#1eff00'), #uncommon-green
@@ -61,17 +82,30 @@ def make_avg_ilvl_parse_bar_plot(raidnight_object):
     fig.set_facecolor('gray')
     plt.show()
 
-def make_heroic_raid_avg_ilvl_parse_scatter_plot(raid_folder):
-    average_parses = []
+def load_folder_raidnights(raid_folder, raid_name=None):
+    '''
+    Returns the raidnights of a folder in chronological order, each loaded once per process (see load_raidnight)
 
-    for filename in [f for f in listdir(raid_folder) if isfile(join(raid_folder, f))]:
-        if 'Ant' in filename:
-            continue
-        raidnight = RaidnightData(filename, 'MyDudes')
-        date = pd.to_datetime(datetime.date.fromtimestamp(raidnight.raidnight_date))
+    Parameters:
+        raid_name (str): only nights of this raid-name, e.g. "Uldir"
+    '''
+    catalog = get_catalog(raid_folder)
+    return [load_raidnight(code, raid_folder) for code in catalog.codes()
+            if raid_name is None or catalog.entries[code]['raid-name'] == raid_name]
+
+def _raidnight_date(raidnight):
+    return pd.to_datetime(datetime.date.fromtimestamp(raidnight.raidnight_date))
+
+def parse_scatter_frame(raidnights):
+    '''
+    Returns the raid's average overall parse for every heroic kill, indexed by date, with columns Boss and Parse
+    '''
+    average_parses = []
+    for raidnight in raidnights:
+        date = _raidnight_date(raidnight)
 
         for boss in raidnight.parse_scrapes.keys():
-            if not re.search('Heroic', boss):
+            if not re.search('Heroic', boss) or not raidnight.parse_scrapes[boss]:
                 continue
             iparselist = [raidnight.parse_scrapes[boss][name]['overall-performance'] for name in raidnight.parse_scrapes[boss].keys()]
             iparse_average = np.mean(iparselist)
@@ -81,43 +115,39 @@ def make_heroic_raid_avg_ilvl_parse_scatter_plot(raid_folder):
 
     parse_df = pd.DataFrame(average_parses, columns=["Boss", "Parse", "Date"])
     parse_df.set_index("Date", inplace=True)
+    return parse_df
 
-    fig = plt.figure(figsize=(15,8))
+def draw_parse_scatter(fig, parse_df, ordered_handles):
     ax = fig.add_subplot(111)
 
-    parse_df.groupby('Boss')['Parse'].plot(legend=True, marker='o', linestyle='')
+    parse_df.groupby('Boss')['Parse'].plot(ax=ax, legend=True, marker='o', linestyle='')
 
     ax.set_title("Raid Overall Parses by Date")
     ax.set_ylabel("Parse Percentile")
     ax.set_xlabel("Date")
     
     handles, labels = ax.get_legend_handles_labels()
-    handles, labels = zip(*sorted(zip(handles, labels), key=lambda x: uldir_ordered_handles[x[1]]))
+    if handles:
+        handles, labels = zip(*sorted(zip(handles, labels), key=lambda x: ordered_handles.get(x[1], len(ordered_handles))))
 
     ax.legend(handles, labels, bbox_to_anchor=(1.02, 1), loc=2, borderaxespad=0.)
-    plt.tight_layout()
+    fig.tight_layout()
 
     ax.set_yticks(np.arange(0,110,10))
 
+def make_heroic_raid_avg_ilvl_parse_scatter_plot(raid_folder):
+    raidnights = [raidnight for raidnight in load_folder_raidnights(raid_folder) if 'Ant' not in raidnight.name]
+    draw_parse_scatter(plt.figure(figsize=(15,8)), parse_scatter_frame(raidnights), uldir_ordered_handles)
     plt.show()
 
-def make_ilvl_chart(raid_folder, playername=None):
+def ilvl_trend_frame(raidnights, playerregex=".*"):
     '''
-    defaults to raid average ilvl
+    Returns the best average equipped ilvl seen on any boss of each night, for the players matching playerregex
     '''
-    title_string = "Raid Average Equipped ilvl"
-    playerregex = ".*"
-    if playername:
-        playerregex = playername
-        title_string = playername + " Best Equipped ilvl"
-
     average_parses = []
 
-    for filename in [join(raid_folder, f) for f in listdir(raid_folder) if isfile(join(raid_folder, f))]:
-        if 'Ant' in filename:
-            continue
-        raidnight = RaidnightData(filename, 'MyDudes')
-        date = pd.to_datetime(datetime.date.fromtimestamp(raidnight.raidnight_date))
+    for raidnight in raidnights:
+        date = _raidnight_date(raidnight)
         top_average_ilevel = 0
 
         for boss in raidnight.damage_done.keys():
@@ -125,6 +155,8 @@ def make_ilvl_chart(raid_folder, playername=None):
                 player_ilevels = [x['itemLevel'] for x in raidnight.damage_done[boss]['entries'] if re.match(playerregex,x['name'])]
             except KeyError:
                 continue
+            if not player_ilevels:
+                continue
             average_ilevel = np.mean(player_ilevels)
             if average_ilevel > top_average_ilevel:
                 top_average_ilevel = average_ilevel
@@ -134,55 +166,136 @@ def make_ilvl_chart(raid_folder, playername=None):
     
     parse_df = pd.DataFrame(average_parses, columns=["Date", "ilevel"])
     parse_df.set_index("Date", inplace=True)
+    return parse_df
 
-    fig = plt.figure(figsize=(15,8))
+def draw_ilvl_trend(fig, parse_df, title_string):
     ax = fig.add_subplot(111)
-    parse_df["ilevel"].plot(legend=None)
+    parse_df["ilevel"].plot(ax=ax, legend=None)
 
     ax.set_ylabel("ilevel")
     ax.set_title(title_string)
 
+def make_ilvl_chart(raid_folder, playername=None):
+    '''
+    defaults to raid average ilvl
+    '''
+    title_string = "Raid Average Equipped ilvl"
+    playerregex = ".*"
+    if playername:
+        playerregex = playername
+        title_string = playername + " Best Equipped ilvl"
+
+    raidnights = [raidnight for raidnight in load_folder_raidnights(raid_folder) if 'Ant' not in raidnight.name]
+    roster_df = roster_ilvl_frame(raidnights) if playername else None
+    if playername and playername in set(roster_df['Player']):
+        parse_df = player_ilvl_frame(roster_df, playername)
+    else:
+        # raid average, or a regex matching several players
+        parse_df = ilvl_trend_frame(raidnights, playerregex)
+    draw_ilvl_trend(plt.figure(figsize=(15,8)), parse_df, title_string)
     plt.show()
 
-def make_raidstats_chart(raid_folder):
-    #TODO: raid duration, cumulative bosses down (heroic only AND normal only)
-    raidstats_data_columns = ["Date", "Lockout Number", "Duration"] + list(uldir_ordered_handles.keys())
+def roster_ilvl_frame(raidnights):
+    '''
+    Returns every player's best equipped ilvl on each night, from a single pass over the nights
+
+    A player's best ilvl is the highest item level logged for them in any boss's damage done.
+
+    Returns:
+        pandas dataframe with columns Date, Player and ilevel, one row per (night, player), in
+        night order and then in the order players first appear in the night's damage done
+    '''
+    night_frames = []
+    for raidnight in raidnights:
+        frame = raidnight.player_frame()
+        frame = frame[frame['dps'].notna() & frame['ilvl'].notna() & (frame['ilvl'] != 0)]
+        best_ilvls = frame.groupby('player', sort=False)['ilvl'].max()
+        night_frames.append(pd.DataFrame({'Date': _raidnight_date(raidnight),
+                                          'Player': best_ilvls.index,
+                                          'ilevel': best_ilvls.values}))
+    if not night_frames:
+        return pd.DataFrame(columns=['Date', 'Player', 'ilevel'])
+    return pd.concat(night_frames, ignore_index=True)
+
+def player_ilvl_frame(roster_df, playername):
+    '''
+    Returns one player's rows of a roster_ilvl_frame in the shape of ilvl_trend_frame
+    '''
+    return roster_df.loc[roster_df['Player'] == playername, ['Date', 'ilevel']].set_index('Date')
+
+def draw_roster_ilvl_grid(fig, roster_df, columns=5):
+    '''
+    Draws one small ilvl trend per player on a shared date and ilvl scale, sizing the figure to the grid
+
+    fig should be created with constrained_layout=True, so the titles and tick labels don't overlap
+    '''
+    players = list(pd.unique(roster_df['Player']))
+    if not players:
+        return
+    rows = -(-len(players)//columns)
+    fig.set_size_inches(3*columns, 2*rows)
+    axes = fig.subplots(rows, columns, sharex=True, sharey=True, squeeze=False).flatten()
+    for ax, player in zip(axes, players):
+        player_df = player_ilvl_frame(roster_df, player)
+        ax.plot(player_df.index, player_df['ilevel'], marker='.')
+        ax.set_title(player, fontsize='small')
+        ax.tick_params(axis='x', labelrotation=30)
+    for ax in axes[len(players):]:
+        ax.set_axis_off()
+    fig.suptitle("Best Equipped ilvl by Player")
+
+def make_roster_ilvl_chart(raid_folder, players=None, columns=5):
+    '''
+    Shows a small-multiples grid of every player's best equipped ilvl, reading the folder once
+
+    Parameters:
+        players (list): only chart these players
+    '''
+    raidnights = [raidnight for raidnight in load_folder_raidnights(raid_folder) if 'Ant' not in raidnight.name]
+    roster_df = roster_ilvl_frame(raidnights)
+    if players:
+        roster_df = roster_df[roster_df['Player'].isin(players)]
+    draw_roster_ilvl_grid(plt.figure(constrained_layout=True), roster_df, columns)
+    plt.show()
+
+def raidstats_frame(raidnights, ordered_handles):
+    '''
+    Returns one row per night, indexed by date, with the lockout number, raid duration and,
+    for each boss of ordered_handles, its position in the raid if it was killed that night
+    '''
+    #TODO: cumulative bosses down (heroic only AND normal only)
+    raidstats_data_columns = ["Date", "Lockout Number", "Duration"] + list(ordered_handles.keys())
 
     raidstats_dictionary = dict()
     for column_header in raidstats_data_columns:
         raidstats_dictionary[column_header] = []
 
-    for filename in [f for f in listdir(raid_folder) if isfile(join(raid_folder, f))]:
-        if filename[:3] == "Ant":
-            continue
-
-        raidnight = RaidnightData(filename, raid_folder)
-
+    for raidnight in raidnights:
         raidstats_dictionary["Lockout Number"].append(raidnight.get_raid_lockout_period())
 
-        date = pd.to_datetime(datetime.date.fromtimestamp(raidnight.raidnight_date))
-        raidstats_dictionary["Date"].append(date)
+        raidstats_dictionary["Date"].append(_raidnight_date(raidnight))
 
         raidnight_duration = pd.to_timedelta(datetime.datetime.fromtimestamp(raidnight.fights['end']//1000) - datetime.datetime.fromtimestamp(raidnight.fights['start']//1000))
         raidstats_dictionary["Duration"].append(raidnight_duration)
 
         for boss in raidstats_data_columns[3:]:
             if boss in raidnight.parse_scrapes.keys():
-                raidstats_dictionary[boss].append(uldir_ordered_handles[boss])
+                raidstats_dictionary[boss].append(ordered_handles[boss])
             else:
                 raidstats_dictionary[boss].append(None)
 
     raidstats_df = pd.DataFrame(raidstats_dictionary, columns=raidstats_data_columns)
     raidstats_df.set_index("Date", inplace=True)
-    print(raidstats_df.head())
+    return raidstats_df
+
+def draw_raidstats(fig, raidstats_df):
     def timeTicks(nanoseconds, pos):
         seconds = nanoseconds//1000000000
         hours = str(int(seconds//3600))
         minutes = str(int((seconds%3600)//60))
         seconds = str(int(seconds%60))
-        return ':'.join([hours, minutes.zfill(2),seconds.zfill(2)])                                                                                                                                                                                                                                                           
-    formatter = mpl.ticker.FuncFormatter(timeTicks)                                                                                                                                                                                                                         
-    fig = plt.figure(1)
+        return ':'.join([hours, minutes.zfill(2),seconds.zfill(2)])
+    formatter = mpl.ticker.FuncFormatter(timeTicks)
     ax = fig.add_subplot(111)
 
     '''for column in raidstats_df.keys():
@@ -192,9 +305,144 @@ def make_raidstats_chart(raid_folder):
 
     ax.set_yticks(np.arange(12))'''
 
-    plt.bar(raidstats_df.index, raidstats_df["Duration"])
+    ax.bar(raidstats_df.index, raidstats_df["Duration"].dt.total_seconds()*1000000000)
     ax.set_yticks(np.arange(0,3600*1000000000*4, 1800*1000000000))
-    ax.yaxis.set_major_formatter(formatter)   
+    ax.yaxis.set_major_formatter(formatter)
+    fig.autofmt_xdate()
+
+def make_raidstats_chart(raid_folder):
+    raidnights = [raidnight for raidnight in load_folder_raidnights(raid_folder) if raidnight.name[:3] != "Ant"]
+    raidstats_df = raidstats_frame(raidnights, uldir_ordered_handles)
+    print(raidstats_df.head())
+    draw_raidstats(plt.figure(1), raidstats_df)
     plt.show()
 
-make_heroic_raid_avg_ilvl_parse_scatter_plot('MyDudes')
\ No newline at end of file
+# chart kind: (draw function, figure size in inches, or None when the draw function sizes the figure)
+chart_drawers = {'parse-scatter': (draw_parse_scatter, (15,8)),
+                 'ilvl-trend': (draw_ilvl_trend, (15,8)),
+                 'raid-duration': (draw_raidstats, (6.4,4.8)),
+                 'roster-ilvl': (draw_roster_ilvl_grid, None)}
+# chart kinds drawn on a figure created with constrained_layout=True
+constrained_charts = {'roster-ilvl'}
+
+def _chart_signature(kind, args):
+    # hash of everything a chart is drawn from
+    inputs = [CHART_VERSION, kind] + [arg.to_json(orient='split', date_format='iso') if isinstance(arg, pd.DataFrame) else arg for arg in args]
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+def _chart_filename(name):
+    return re.sub(r'[^\w\-]', '_', name)
+
+def render_chart(kind, args, paths):
+    '''
+    Draws one chart on the Agg canvas (no display needed) and writes it to every path
+
+    The format of each file follows its extension, e.g. .png or .svg.
+    '''
+    draw, figsize = chart_drawers[kind]
+    fig = Figure(figsize=figsize, constrained_layout=kind in constrained_charts)
+    FigureCanvasAgg(fig)
+    draw(fig, *args)
+    for path in paths:
+        fig.savefig(path)
+    return paths
+
+def dashboard_charts(raidnights, raid_name):
+    '''
+    Returns every dashboard chart of one raid as (chart name, chart kind, draw arguments)
+    '''
+    ordered_handles = raid_ordered_handles.get(raid_name, dict())
+    charts = [(f'{raid_name}-parse-scatter', 'parse-scatter', (parse_scatter_frame(raidnights), ordered_handles)),
+              (f'{raid_name}-ilvl-trend', 'ilvl-trend', (ilvl_trend_frame(raidnights), "Raid Average Equipped ilvl")),
+              (f'{raid_name}-raid-duration', 'raid-duration', (raidstats_frame(raidnights, ordered_handles),))]
+
+    # every player's chart comes from one pass over the nights
+    roster_df = roster_ilvl_frame(raidnights)
+    charts.append((f'{raid_name}-roster-ilvl', 'roster-ilvl', (roster_df,)))
+    for player in pd.unique(roster_df['Player']):
+        charts.append((f'{raid_name}-ilvl-{player}', 'ilvl-trend',
+                       (player_ilvl_frame(roster_df, player), player + " Best Equipped ilvl")))
+    return charts
+
+def render_dashboard(raid_folder, out_folder, formats=CHART_FORMATS, max_workers=None, force=False):
+    '''
+    Renders every chart of every raid in a folder to image files, headless and in parallel
+
+    The folder is loaded once; charts whose inputs are unchanged since the last render (and whose
+    files still exist) are skipped, so a nightly run only redraws what new nights changed.
+
+    Parameters:
+        raid_folder (str): the folder of raid files
+        out_folder (str): where the charts and their input signatures are written
+        formats (iterable): image formats to write, e.g. ('png', 'svg')
+        max_workers (int): the number of charts drawn at once (default: one per core)
+        force (bool): redraw every chart
+
+    Returns:
+        dict: {'rendered': [chart names], 'skipped': [chart names], 'failed': [(chart name, error)]}
+    '''
+    if not isdir(out_folder):
+        makedirs(out_folder)
+    signatures_path = join(out_folder, CHART_INPUTS_FILENAME)
+    try:
+        with open(signatures_path, 'r') as open_file:
+            signatures = json.load(open_file)
+    except (IOError, ValueError):
+        signatures = dict()
+
+    catalog = get_catalog(raid_folder)
+    raid_names = []
+    for code in catalog.codes():
+        if catalog.entries[code]['raid-name'] not in raid_names:
+            raid_names.append(catalog.entries[code]['raid-name'])
+    raidnights = load_folder_raidnights(raid_folder)
+
+    charts = []
+    for raid_name in raid_names:
+        charts += dashboard_charts([raidnight for raidnight in raidnights if raidnight.raid_name == raid_name], raid_name)
+
+    results = {'rendered': [], 'skipped': [], 'failed': []}
+    pending = []
+    for name, kind, args in charts:
+        paths = [join(out_folder, f'{_chart_filename(name)}.{extension}') for extension in formats]
+        signature = _chart_signature(kind, args)
+        if not force and signatures.get(name) == signature and all(isfile(path) for path in paths):
+            results['skipped'].append(name)
+            continue
+        pending.append((name, kind, args, paths, signature))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(render_chart, kind, args, paths) for _, kind, args, paths, _ in pending]
+            for (name, _, _, _, signature), future in zip(pending, futures):
+                try:
+                    future.result()
+                except Exception as error:
+                    results['failed'].append((name, repr(error)))
+                    continue
+                signatures[name] = signature
+                results['rendered'].append(name)
+
+        atomic_write(signatures_path, lambda open_file: json.dump(signatures, open_file, indent=4))
+
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the raid dashboard charts of a raid folder to image files')
+    parser.add_argument('raid_folder', type=str, nargs='?', default='MyDudes',
+                        help="the directory containing raid json files")
+    parser.add_argument('-out', type=str,
+                        help="the directory to write charts to (default: charts/ next to this script)")
+    parser.add_argument('-format', type=str, nargs='+', default=list(CHART_FORMATS),
+                        help="image formats to write, e.g. png svg")
+    parser.add_argument('-jobs', type=int,
+                        help="the number of charts to draw in parallel (default: one per core)")
+    parser.add_argument('-force', action='store_true',
+                        help="redraw charts even if their inputs are unchanged")
+    args = parser.parse_args()
+
+    out_folder = args.out if args.out else join(dirname(realpath(__file__)), 'charts')
+    results = render_dashboard(args.raid_folder, out_folder, args.format, args.jobs, args.force)
+    for name, error in results['failed']:
+        print(f'{name}: chart failed ({error})')
+    print(f"{len(results['rendered'])} charts rendered, {len(results['skipped'])} unchanged")
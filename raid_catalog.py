@@ -0,0 +1,337 @@
+""" A persistent index of the raid json files in a raid folder
+
+Reading a raid json file costs a full json.load of several megabytes, so the catalog
+records the handful of fields needed to find a raidnight (wcl code, zone, difficulty,
+date and lockout) once per file, and stores them in the folder next to the raid files.
+Entries are only re-read when a file's mtime or size changes; lockouts are recomputed
+from the stored zone and date when zones.json or raid-release-dates.json change. Each
+entry also keeps the byte offsets of the file's top-level sections (see raid_sections) for lazy loading.
+When a night exists in several formats, the columnar .npz file is indexed first, then a
+compressed json file (see raid_compression), then plain json.
+"""
+
+import json
+import re
+from os import listdir, stat
+from os.path import join, realpath
+
+from raid_columnar import COLUMNAR_EXTENSION
+from raid_compression import atomic_write
+from raid_sections import open_section_reader
+from wcl_zones import get_lockout_period, lockout_source_mtimes
+
+CATALOG_FILENAME = '.raid-catalog.json'
+CATALOG_VERSION = 3
+
+# e.g. "Uldir-Heroic-18-09-04(abcdEFGH12345678).json" or the same name ending in .json.gz, .json.zst or .npz
+raid_filename_regex = re.compile(r'^(?P<name>.+)\((?P<code>[^()]+)\)(?P<extension>\.json(?:\.gz|\.zst)?|\.npz)$')
+# which file of a night is indexed when it exists in several formats (highest first)
+extension_preference = {COLUMNAR_EXTENSION: 2, '.json.gz': 1, '.json.zst': 1, '.json': 0}
+
+# wcl fight difficulty: the name used in fight and file names; the one definition, also
+# RaidnightData.difficulty_dict (raid_night_summarizer imports this module, not the reverse)
+difficulty_dict = {1: "Raid-Finder",
+                   2: "Flex",
+                   3: "Normal",
+                   4: "Heroic"}
+
+
+def lookup_lockout(zone, raidnight_date, raid_folder):
+    """
+    Returns the lockout of a night, or None if its raid has no entry in raid-release-dates.json
+    """
+    try:
+        return get_lockout_period(zone, raidnight_date, raid_folder)
+    except KeyError:
+        return None
+
+
+def read_raid_metadata(filepath, raid_folder):
+    """
+    Reads the catalog fields for a single raid json file
+
+    Parameters:
+    filepath (str): path to the raid json (or columnar .npz) file
+    raid_folder (str): the folder holding the file (used for zone and lockout lookups)
+
+    Returns:
+    (dict): zone, raid-name, difficulty, date, lockout and section offsets for the raidnight
+    """
+    section_reader = open_section_reader(filepath)
+    fights = section_reader.read('fights')
+
+    highest_difficulty = 1
+    for fight in fights['fights']:
+        try:
+            if fight['difficulty'] and fight['difficulty'] > highest_difficulty:
+                highest_difficulty = fight['difficulty']
+        except KeyError:
+            pass
+
+    raidnight_date = fights['start']//1000
+    return {'zone': fights['zone'],
+            'raid-name': section_reader.read('raid-name'),
+            'difficulty': difficulty_dict[highest_difficulty],
+            'date': raidnight_date,
+            'lockout': lookup_lockout(fights['zone'], raidnight_date, raid_folder),
+            'sections': getattr(section_reader, 'offsets', dict())}
+
+
+class RaidCatalog():
+    """An index of every raid json file in a raid folder, keyed by wcl code
+    Attributes:
+        raid_folder: the folder being indexed
+        entries: dictionary of form {wcl_code: entry}, where each entry holds
+                filename, mtime, size, zone, raid-name, difficulty, date, lockout and sections
+        """
+
+    def __init__(self, raid_folder):
+        self.raid_folder = raid_folder
+        self.catalog_path = join(raid_folder, CATALOG_FILENAME)
+        self.entries = dict()
+        self._folder_mtime = None
+        self._lockout_index = dict()
+        # lockout_source_mtimes when the stored lockouts were computed
+        self._lockout_sources = None
+
+        try:
+            with open(self.catalog_path, 'r') as open_file:
+                catalog_dict = json.load(open_file)
+            if catalog_dict.get('version') == CATALOG_VERSION:
+                self.entries = catalog_dict['entries']
+                self._lockout_sources = catalog_dict.get('lockout-sources')
+        except (IOError, ValueError):
+            pass
+
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """
+        Brings the catalog up to date with the files on disk
+
+        Only files that are new, or whose mtime or size changed, are re-read, and lockouts are
+        recomputed if zones.json or raid-release-dates.json changed. Unless force is set, nothing
+        else is done while the folder's own mtime is unchanged.
+
+        Returns:
+        (bool): True if any entry changed
+        """
+        lockout_sources = lockout_source_mtimes(self.raid_folder)
+        folder_mtime = stat(self.raid_folder).st_mtime
+        if not force and folder_mtime == self._folder_mtime and lockout_sources == self._lockout_sources:
+            return False
+        self._folder_mtime = folder_mtime
+
+        changed = False
+        if lockout_sources != self._lockout_sources:
+            # e.g. a release date was added after nights of that raid were indexed
+            self._lockout_sources = lockout_sources
+            for entry in self.entries.values():
+                entry['lockout'] = lookup_lockout(entry['zone'], entry['date'], self.raid_folder)
+            changed = True
+
+        folder_files = dict()
+        for filename in listdir(self.raid_folder):
+            match = raid_filename_regex.match(filename)
+            if not match:
+                continue
+            code = match.group('code')
+            if (code not in folder_files or extension_preference[match.group('extension')]
+                    > extension_preference[raid_filename_regex.match(folder_files[code]).group('extension')]):
+                folder_files[code] = filename
+
+        for code, filename in folder_files.items():
+            if self._update_entry(code, filename):
+                changed = True
+
+        for code in [c for c in self.entries if c not in folder_files]:
+            del self.entries[code]
+            changed = True
+
+        if changed or not self._lockout_index:
+            self._build_index()
+        if changed:
+            self.save()
+        return changed
+
+    def update_file(self, filepath):
+        """
+        Adds or refreshes the entry for a single raid file, e.g. one that was just written
+        """
+        filename = filepath.replace('\\', '/').split('/')[-1]
+        match = raid_filename_regex.match(filename)
+        if not match:
+            return
+        if self._update_entry(match.group('code'), filename):
+            self._build_index()
+            self.save()
+        else:
+            self._folder_mtime = stat(self.raid_folder).st_mtime
+
+    def _update_entry(self, code, filename):
+        file_stat = stat(join(self.raid_folder, filename))
+        entry = self.entries.get(code)
+        if (entry and entry['filename'] == filename and entry['mtime'] == file_stat.st_mtime
+                and entry['size'] == file_stat.st_size):
+            return False
+
+        entry = {'filename': filename,
+                 'name': raid_filename_regex.match(filename).group('name'),
+                 'mtime': file_stat.st_mtime,
+                 'size': file_stat.st_size}
+        entry.update(read_raid_metadata(join(self.raid_folder, filename), self.raid_folder))
+        self.entries[code] = entry
+        return True
+
+    def _build_index(self):
+        self._lockout_index = dict()
+        for code in self.codes():
+            entry = self.entries[code]
+            key = (entry['raid-name'], entry['lockout'])
+            self._lockout_index.setdefault(key, []).append(code)
+
+    def save(self):
+        catalog_dict = {'version': CATALOG_VERSION, 'lockout-sources': self._lockout_sources,
+                        'entries': self.entries}
+        atomic_write(self.catalog_path, lambda open_file: json.dump(catalog_dict, open_file, indent=4))
+        self._folder_mtime = stat(self.raid_folder).st_mtime
+
+    def codes(self):
+        # sorted by filename, which sorts chronologically within a raid
+        return sorted(self.entries, key=lambda code: self.entries[code]['filename'])
+
+    def filenames(self):
+        return [self.entries[code]['filename'] for code in self.codes()]
+
+    def get(self, code):
+        """
+        Returns the entry for a wcl code, re-reading it first if its file changed on disk
+        """
+        entry = self.entries.get(code)
+        if entry and self._update_entry(code, entry['filename']):
+            self._build_index()
+            self.save()
+        return self.entries.get(code)
+
+    def path(self, code):
+        return join(self.raid_folder, self.entries[code]['filename'])
+
+    def find_code(self, initializationdata):
+        """
+        Finds the wcl code of a raid file, falling back to a search of the indexed filenames
+
+        Returns:
+        (str): the matching wcl code, or None
+        """
+        if initializationdata in self.entries:
+            return initializationdata
+
+        for code in self.codes():
+            if re.search(re.escape(initializationdata), self.path(code)):
+                return code
+        return None
+
+    def find(self, initializationdata):
+        """
+        Returns:
+        (str): the path of the raid file matching a wcl code or filename, or None
+        """
+        code = self.find_code(initializationdata)
+        return self.path(code) if code else None
+
+    def codes_in_lockout(self, raid_name, lockout):
+        return list(self._lockout_index.get((raid_name, lockout), []))
+
+    def query(self, **criteria):
+        """
+        Returns the codes of all entries matching every given field, e.g. query(difficulty='Heroic', lockout=3)
+        """
+        return [code for code in self.codes()
+                if all(self.entries[code].get(field) == value for field, value in criteria.items())]
+
+
+class NightStore():
+    """Per-night data derived from a raid folder's files, stored next to them and kept in step with the catalog
+
+    Subclasses set filename and version and implement read_night. refresh only reads nights
+    that are new or whose file changed (by mtime and size), and drops nights no longer in the folder.
+    Attributes:
+        raid_folder: the folder the nights come from
+        nights: dictionary of form {wcl_code: night}, where each night holds the file's mtime and size
+                and whatever read_night returned
+        """
+    filename = None
+    version = None
+
+    def __init__(self, raid_folder):
+        self.raid_folder = raid_folder
+        self.store_path = join(raid_folder, self.filename)
+        self.nights = dict()
+
+        try:
+            with open(self.store_path, 'r') as open_file:
+                store_dict = json.load(open_file)
+            if store_dict.get('version') == self.version:
+                self.nights = store_dict['nights']
+        except (IOError, ValueError):
+            pass
+
+    def read_night(self, code, entry):
+        """
+        Returns the stored fields of one night (a dict), given its code and catalog entry
+        """
+        raise NotImplementedError
+
+    def update_night(self, night, entry):
+        """
+        Updates an unchanged night's fields that are taken from its catalog entry
+
+        Returns:
+        (bool): True if the night changed
+        """
+        return False
+
+    def refresh(self):
+        """
+        Reads every night that is new or whose file changed, and drops nights no longer in the folder
+
+        Returns:
+        (bool): True if the store changed
+        """
+        catalog = get_catalog(self.raid_folder)
+        changed = False
+        for code in catalog.codes():
+            entry = catalog.entries[code]
+            night = self.nights.get(code)
+            if night and night['mtime'] == entry['mtime'] and night['size'] == entry['size']:
+                changed = self.update_night(night, entry) or changed
+                continue
+            self.nights[code] = dict(self.read_night(code, entry), mtime=entry['mtime'], size=entry['size'])
+            changed = True
+
+        for code in [c for c in self.nights if c not in catalog.entries]:
+            del self.nights[code]
+            changed = True
+
+        if changed:
+            self.save()
+        return changed
+
+    def save(self):
+        store_dict = {'version': self.version, 'nights': self.nights}
+        atomic_write(self.store_path, lambda open_file: json.dump(store_dict, open_file))
+
+
+_catalogs = dict()
+
+
+def get_catalog(raid_folder):
+    """
+    Returns the process-wide RaidCatalog for a raid folder, refreshed if the folder changed
+    """
+    key = realpath(raid_folder)
+    if key not in _catalogs:
+        _catalogs[key] = RaidCatalog(raid_folder)
+    else:
+        _catalogs[key].refresh()
+    return _catalogs[key]
@@ -0,0 +1,204 @@
+""" Compact columnar storage for raid nights
+
+A raid night is stored as a single compressed NumPy .npz file holding flat per-fight,
+per-player tables (name, class, spec icon, itemLevel, total, activeTime, parses, deaths)
+plus a small json blob with the wcl fights metadata and wipes. Only the fields used by
+the summarizer are kept; abilities, gear, talents, targets and pets are dropped.
+
+Usage:
+    python raid_columnar.py MyDudes [--remove-json]
+"""
+
+import argparse
+import json
+from os import listdir, remove
+from os.path import join
+
+import numpy as np
+
+from raid_compression import RAID_JSON_EXTENSIONS, load_json
+
+COLUMNAR_EXTENSION = '.npz'
+
+# columns kept from each damage-done/healing entry
+player_columns = ['name', 'type', 'icon', 'itemLevel', 'total', 'activeTime']
+# column: the value stored when an entry lacks it; itemLevel is -1 when wcl omitted it
+player_column_defaults = {'name': '', 'type': '', 'icon': '', 'itemLevel': -1, 'total': 0, 'activeTime': 0}
+table_prefixes = {'damage-done': 'damage', 'healing': 'healing'}
+
+
+def _string_array(values):
+    return np.array(values, dtype=str) if values else np.zeros(0, dtype='<U1')
+
+
+def _flatten_player_table(section_dict, prefix):
+    fight_totals = []
+    columns = {column: [] for column in ['fight'] + player_columns}
+    for fight_number, (fight_name, table) in enumerate(section_dict.items()):
+        fight_totals.append([fight_name, table['totalTime']])
+        for entry in table.get('entries', []):
+            columns['fight'].append(fight_number)
+            for column in player_columns:
+                columns[column].append(entry.get(column, player_column_defaults[column]))
+
+    arrays = {prefix + '_fight': np.array(columns['fight'], dtype=np.int16)}
+    for column in ['name', 'type', 'icon']:
+        arrays[prefix + '_' + column] = _string_array(columns[column])
+    arrays[prefix + '_itemLevel'] = np.array(columns['itemLevel'], dtype=np.int16)
+    arrays[prefix + '_total'] = np.array(columns['total'], dtype=np.int64)
+    arrays[prefix + '_activeTime'] = np.array(columns['activeTime'], dtype=np.int64)
+    return arrays, fight_totals
+
+
+def write_columnar(file_dict, filepath):
+    """
+    Writes a raid night dictionary (as saved by RaidnightData) to a columnar .npz file
+
+    Parameters:
+    file_dict (dict): the full raid json dictionary
+    filepath (str): the output path, ending in .npz
+    """
+    arrays = dict()
+    meta = {'fights': file_dict['fights'],
+            'wipes': file_dict['wipes'],
+            'raidnight-date': file_dict['raidnight-date'],
+            'raid-name': file_dict['raid-name'],
+            'raid-difficulty': file_dict['raid-difficulty']}
+
+    for section, prefix in table_prefixes.items():
+        table_arrays, fight_totals = _flatten_player_table(file_dict[section], prefix)
+        arrays.update(table_arrays)
+        meta[section] = fight_totals
+
+    parse_columns = {'fight': [], 'name': [], 'overall': [], 'ilvl': []}
+    meta['parse-scrapes'] = list(file_dict['parse-scrapes'].keys())
+    for fight_number, fight_name in enumerate(meta['parse-scrapes']):
+        for player_name, parse in file_dict['parse-scrapes'][fight_name].items():
+            parse_columns['fight'].append(fight_number)
+            parse_columns['name'].append(player_name)
+            parse_columns['overall'].append(parse['overall-performance'])
+            parse_columns['ilvl'].append(parse['ilvl-performance'])
+    arrays['parse_fight'] = np.array(parse_columns['fight'], dtype=np.int16)
+    arrays['parse_name'] = _string_array(parse_columns['name'])
+    arrays['parse_overall'] = np.array(parse_columns['overall'], dtype=np.int16)
+    arrays['parse_ilvl'] = np.array(parse_columns['ilvl'], dtype=np.int16)
+
+    death_columns = {'fight': [], 'name': [], 'icon': [], 'timestamp': []}
+    meta['deaths'] = list(file_dict['deaths'].keys())
+    for fight_number, fight_name in enumerate(meta['deaths']):
+        for entry in file_dict['deaths'][fight_name]['entries']:
+            death_columns['fight'].append(fight_number)
+            death_columns['name'].append(entry['name'])
+            death_columns['icon'].append(entry['icon'])
+            death_columns['timestamp'].append(entry['timestamp'])
+    arrays['death_fight'] = np.array(death_columns['fight'], dtype=np.int16)
+    arrays['death_name'] = _string_array(death_columns['name'])
+    arrays['death_icon'] = _string_array(death_columns['icon'])
+    arrays['death_timestamp'] = np.array(death_columns['timestamp'], dtype=np.int64)
+
+    arrays['meta'] = np.array(json.dumps(meta))
+    with open(filepath, 'wb') as open_file:
+        np.savez_compressed(open_file, **arrays)
+
+
+class ColumnarReader():
+    """Rebuilds the sections of a raid json dictionary from a columnar .npz file
+
+    Sections are rebuilt on request, with the same shape RaidnightData expects from json,
+    but player entries only carry the stored columns.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._meta = None
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            with np.load(self.filepath, allow_pickle=False) as npz_file:
+                self._meta = json.loads(str(npz_file['meta']))
+        return self._meta
+
+    def _columns(self, prefix, names):
+        with np.load(self.filepath, allow_pickle=False) as npz_file:
+            return [npz_file[prefix + '_' + name].tolist() for name in names]
+
+    def _player_table(self, section):
+        prefix = table_prefixes[section]
+        fights, *columns = self._columns(prefix, ['fight'] + player_columns)
+        section_dict = {fight_name: {'entries': [], 'totalTime': total_time}
+                        for fight_name, total_time in self.meta[section]}
+        fight_names = [fight_name for fight_name, _ in self.meta[section]]
+        for fight_number, *values in zip(fights, *columns):
+            entry = dict(zip(player_columns, values))
+            if entry['itemLevel'] == -1:
+                del entry['itemLevel']
+            section_dict[fight_names[fight_number]]['entries'].append(entry)
+        return section_dict
+
+    def _parse_scrapes(self):
+        fight_names = self.meta['parse-scrapes']
+        section_dict = {fight_name: dict() for fight_name in fight_names}
+        for fight_number, name, overall, ilvl in zip(*self._columns('parse', ['fight', 'name', 'overall', 'ilvl'])):
+            section_dict[fight_names[fight_number]][name] = {'overall-performance': overall,
+                                                             'ilvl-performance': ilvl}
+        return section_dict
+
+    def _deaths(self):
+        fight_names = self.meta['deaths']
+        section_dict = {fight_name: {'entries': []} for fight_name in fight_names}
+        for fight_number, name, icon, timestamp in zip(*self._columns('death', ['fight', 'name', 'icon', 'timestamp'])):
+            section_dict[fight_names[fight_number]]['entries'].append(
+                {'name': name, 'icon': icon, 'timestamp': timestamp})
+        return section_dict
+
+    def read(self, key):
+        if key in table_prefixes:
+            return self._player_table(key)
+        if key == 'parse-scrapes':
+            return self._parse_scrapes()
+        if key == 'deaths':
+            return self._deaths()
+        return self.meta[key]
+
+    def read_all(self):
+        return {key: self.read(key) for key in ['fights', 'damage-done', 'healing', 'deaths', 'wipes',
+                                                'parse-scrapes', 'raidnight-date', 'raid-name', 'raid-difficulty']}
+
+
+def convert_folder(raid_folder, remove_json=False):
+    """
+    Writes a columnar .npz copy of every raid json file in a folder
+
+    Parameters:
+    raid_folder (str): the folder of raid json files
+    remove_json (bool): delete each json file once its .npz copy is written
+
+    Returns:
+    (list): the paths of the written .npz files
+    """
+    written = []
+    for filename in sorted(listdir(raid_folder)):
+        extension = next((extension for extension in RAID_JSON_EXTENSIONS if filename.endswith(')' + extension)), None)
+        if not extension:
+            continue
+        json_path = join(raid_folder, filename)
+        npz_path = json_path[:-len(extension)] + COLUMNAR_EXTENSION
+        file_dict = load_json(json_path)
+        print(npz_path)
+        write_columnar(file_dict, npz_path)
+        written.append(npz_path)
+        if remove_json:
+            remove(json_path)
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert raid json caches to columnar .npz files')
+    parser.add_argument('raid_folder', type=str,
+                        help="the directory containing raid json files")
+    parser.add_argument('--remove-json', action='store_true',
+                        help="delete each json file after converting it")
+    args = parser.parse_args()
+
+    convert_folder(args.raid_folder, args.remove_json)
@@ -0,0 +1,193 @@
+""" Compressed storage of raid json files
+
+Raid json files repeat the same player names, spec icons, gear and ability names in every
+fight, so they compress by an order of magnitude. A raid file may be stored as plain json,
+gzip (".json.gz") or zstd (".json.zst"); the format is taken from the extension, or from the
+file's first bytes when the extension says nothing. Every reader in raid_sections and
+raid_stream opens files through open_raid_file, so compressed files are read transparently.
+
+zstd needs the zstandard package from requirements.txt; without it, .json.zst files raise
+an ImportError naming the package. gzip only needs the standard library.
+
+Compressed files are written without indentation. They have no section offsets (see
+raid_sections.index_sections), so a lazily loaded night decompresses the whole file on its
+first read; the smaller read usually more than makes up for that on a cold disk.
+
+Usage:
+    python raid_compression.py MyDudes [-format gzip|zstd|none] [-level 6] [-keep]
+"""
+
+import argparse
+import gzip
+import io
+import json
+from os import getpid, listdir, remove, replace
+from os.path import getsize, join
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# compression format: the extension added after .json
+compression_extensions = {'gzip': '.gz', 'zstd': '.zst'}
+RAID_JSON_EXTENSIONS = ('.json', '.json.gz', '.json.zst')
+COMPRESSION_FORMATS = ('gzip', 'zstd', 'none')
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 10}
+
+
+def detect_compression(filepath):
+    """
+    Returns 'gzip', 'zstd' or None (plain json) for a raid file, by extension or else by magic bytes
+    """
+    for compression, extension in compression_extensions.items():
+        if filepath.endswith(extension):
+            return compression
+    if filepath.endswith('.json'):
+        return None
+    with open(filepath, 'rb') as open_file:
+        magic = open_file.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic == ZSTD_MAGIC:
+        return 'zstd'
+    return None
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError('reading or writing .json.zst raid files needs the zstandard package')
+
+
+def open_raid_file(filepath, mode='rb'):
+    """
+    Opens a raid file for reading, decompressing it if needed
+
+    Parameters:
+    mode (str): 'rb' for bytes or 'r' for text
+
+    Returns:
+    a file object, to be used as a context manager
+    """
+    compression = detect_compression(filepath)
+    if compression is None:
+        return open(filepath, mode, encoding=None if 'b' in mode else 'utf-8')
+    if compression == 'gzip':
+        binary_file = gzip.open(filepath, 'rb')
+    else:
+        _require_zstandard()
+        binary_file = zstandard.ZstdDecompressor().stream_reader(open(filepath, 'rb'), closefd=True)
+    return binary_file if 'b' in mode else io.TextIOWrapper(binary_file, encoding='utf-8')
+
+
+def load_json(filepath):
+    with open_raid_file(filepath, 'rb') as open_file:
+        return json.loads(open_file.read())
+
+
+def atomic_write(filepath, write, mode='w', encoding=None):
+    """
+    Writes a file through a per-process temp file that is then renamed over it
+
+    Readers never see a partly written file, and processes writing the same file at once
+    (e.g. report workers saving the catalog) don't clobber each other's temp file.
+
+    Parameters:
+    write (function): write(open_file) writes the contents
+    mode (str): 'w' for text or 'wb' for bytes
+    """
+    temp_path = f'{filepath}.{getpid()}.tmp'
+    with open(temp_path, mode, encoding=encoding) as open_file:
+        write(open_file)
+    replace(temp_path, filepath)
+
+
+def with_compression(filepath, compression):
+    """
+    Returns the path of a raid json file stored with another compression ('gzip', 'zstd' or None)
+    """
+    for extension in sorted(RAID_JSON_EXTENSIONS, key=len, reverse=True):
+        if filepath.endswith(extension):
+            filepath = filepath[:-len(extension)]
+            break
+    return filepath + '.json' + compression_extensions.get(compression, '')
+
+
+def dump_json(data, filepath, compression=None, level=None):
+    """
+    Writes a raid json dictionary, compressed if compression (or else the path's extension) asks for it
+
+    Plain json keeps indent=4, which raid_sections relies on for section offsets.
+    """
+    if compression is None:
+        compression = next((name for name, extension in compression_extensions.items()
+                            if filepath.endswith(extension)), None)
+    if compression is None:
+        atomic_write(filepath, lambda open_file: json.dump(data, open_file, indent=4), encoding='utf-8')
+        return
+
+    encoded = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    level = level if level is not None else DEFAULT_LEVELS[compression]
+    if compression == 'gzip':
+        def write(open_file):
+            # mtime=0 so the same data always compresses to the same bytes
+            with gzip.GzipFile(fileobj=open_file, mode='wb', compresslevel=level, mtime=0) as gzip_file:
+                gzip_file.write(encoded)
+    else:
+        _require_zstandard()
+        compressed = zstandard.ZstdCompressor(level=level).compress(encoded)
+
+        def write(open_file):
+            open_file.write(compressed)
+    atomic_write(filepath, write, 'wb')
+
+
+def compact_folder(raid_folder, compression='gzip', level=None, keep=False):
+    """
+    Rewrites every raid json file in a folder with another compression
+
+    Parameters:
+    raid_folder (str): the folder of raid json files
+    compression (str): 'gzip', 'zstd', or None to write plain indented json again
+    keep (bool): keep the original files (the catalog then indexes the compressed ones)
+
+    Returns:
+    (list): (new path, original size, new size) for every rewritten file
+    """
+    rewritten = []
+    for filename in sorted(listdir(raid_folder)):
+        if not any(filename.endswith(')' + extension) for extension in RAID_JSON_EXTENSIONS):
+            continue
+        path = join(raid_folder, filename)
+        new_path = with_compression(path, compression)
+        if new_path == path:
+            continue
+        original_size = getsize(path)
+        dump_json(load_json(path), new_path, compression, level)
+        if not keep:
+            remove(path)
+        rewritten.append((new_path, original_size, getsize(new_path)))
+        print(f'{filename}: {original_size/1e6:.1f}MB -> {getsize(new_path)/1e6:.1f}MB')
+    return rewritten
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compress (or decompress) the raid json files of a folder')
+    parser.add_argument('raid_folder', type=str,
+                        help="the directory containing raid json files")
+    parser.add_argument('-format', type=str, default='gzip', choices=COMPRESSION_FORMATS,
+                        help="the compression to rewrite the files with (default: gzip)")
+    parser.add_argument('-level', type=int,
+                        help="the compression level (default: 6 for gzip, 10 for zstd)")
+    parser.add_argument('-keep', action='store_true',
+                        help="keep the original files")
+    args = parser.parse_args()
+
+    compression = None if args.format == 'none' else args.format
+    rewritten = compact_folder(args.raid_folder, compression, args.level, args.keep)
+    before = sum(original_size for _, original_size, _ in rewritten)
+    after = sum(new_size for _, _, new_size in rewritten)
+    if rewritten:
+        print(f'{len(rewritten)} files: {before/1e6:.1f}MB -> {after/1e6:.1f}MB')
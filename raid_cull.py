@@ -1,7 +1,6 @@
-from raid_night_summarizer import RaidnightData
-from collections import defaultdict
+from raid_night_summarizer import load_raidnight
+from season_aggregate import get_season_aggregate, ilvl_parse_matrix, raidnights_table
 import pandas as pd
-import numpy as np
 
 ignore_specs = {'Monk-Mistweaver',
                 'Paladin-Holy',
@@ -15,43 +14,81 @@ ignore_specs = {'Monk-Mistweaver',
                 'DeathKnight-Blood',
                 'Druid-Guardian'}
 
-def rank_dps(raidnights):
+def _parse_table(raidnights):
+    # a long parse table (see season_aggregate) is used as given; RaidnightData objects are tabulated
+    if isinstance(raidnights, pd.DataFrame):
+        return raidnights
+    return raidnights_table(raidnights)
+
+# seconds in a day, for recency weighting by night date (unix seconds)
+SECONDS_PER_DAY = 24*60*60
+
+def _rank_weights(table, weight, recency_half_life):
+    # product of the requested weights for every row; equal weights when none are requested
+    if weight is None:
+        weight = []
+    elif isinstance(weight, str):
+        weight = [weight]
+
+    weights = pd.Series(1.0, index=table.index)
+    for name in weight:
+        if name == 'duration':
+            weights *= table['fight_time']
+        elif name == 'recency':
+            days_old = (table['date'].max() - table['date']) / SECONDS_PER_DAY
+            weights *= 0.5 ** (days_old / recency_half_life)
+        else:
+            raise ValueError(f"unknown rank weight '{name}', expected 'duration' or 'recency'")
+    return weights
+
+def dps_rank_scores(raidnights, method='min', difficulties=('Heroic',), weight=None, recency_half_life=14, by=None):
     '''
-    Returns an ordered list of dps player names, from highest average dps rank across all bosses to lowest
+    Returns every dps player's (weighted) mean rank across the fights of the given raids, lowest (best) first
+
+    Each player is ranked by dps within every fight of every night; the ranks are then averaged
+    per player in one grouped pass, so a whole tier of nights can be scored at once.
 
     Parameters:
-    raidnights: a list of RaidnightData objects, representing the raids within a single lockout to be analyzed
+    raidnights: a RaidnightData object, a list of them, or a long parse table such as SeasonAggregate.parse_table()
+    method (str): how tied dps values are ranked, as for pandas.Series.rank: 'min', 'average', 'max', 'first' or 'dense'
+    difficulties (iterable): fight difficulties to include, e.g. ('Heroic', 'Mythic'); None for every difficulty
+    weight (str or list): 'duration' weights each fight's rank by its length, 'recency' by the age of the night,
+        halving every recency_half_life days; both may be given
+    recency_half_life (float): days, for the 'recency' weight
+    by (list): extra columns of the parse table to score separately, e.g. ['lockout'] or ['difficulty']
+
+    Returns:
+    (pandas.Series): mean rank, indexed by player (or by the by columns and player); players in
+        equal standing keep the order they first appear in
     '''
+    table = _parse_table(raidnights)
+    table = table[table['dps'].notna() & ~table['spec'].isin(ignore_specs)]
+    if difficulties is not None:
+        table = table[table['boss'].str.split(' ', n=1).str[0].isin(list(difficulties))]
 
-    if not isinstance(raidnights, list):
-        raidnights = [raidnights]
+    # damage, not the int-rounded dps, so near-equal players are not tied
+    ranks = table.groupby(['code', 'boss'], sort=False)['damage'].rank(method=method, ascending=False)
+    weights = _rank_weights(table, weight, recency_half_life)
 
-    # construct a dictionary with k:v :: player:list_of_ranks  e.g. Bradney:[1,1,2,4,2]
-    player_ranks = defaultdict(list)
-    for raidnight in raidnights:
-        for fight in raidnight.damage_done.keys():
-            if fight[:6] != 'Heroic':
-                continue
-            # instantiate dict for fight
-            fight_damage_values = dict()
-
-            # store player:damage in fight dict
-            fight_entries = raidnight.damage_done[fight]['entries']
-            for player in fight_entries:
-                if player['icon'] in ignore_specs:
-                    continue
-                player_name = player['name']
-                player_damage = player['total']
-                fight_damage_values[player_name] = player_damage
-            
-            # rank player damage values and store rank in player_ranks
-            ## note that this does not handle cases where players have exactly the same total damage, though this is unlikely
-            for rank, player in enumerate(sorted(fight_damage_values, key=fight_damage_values.get, reverse=True), start=1):
-                player_ranks[player].append(rank)
-
-    ranked_dps = sorted(player_ranks, key=lambda x: np.mean(player_ranks[x]))
-
-    return ranked_dps
+    keys = [table[column] for column in (by or [])] + [table['player']]
+    weighted_ranks = (ranks*weights).groupby(keys, sort=False).sum()
+    scores = weighted_ranks / weights.groupby(keys, sort=False).sum()
+
+    if by:
+        return scores.groupby(level=list(range(len(by))), sort=False, group_keys=False).apply(
+            lambda group: group.sort_values(kind='mergesort'))
+    return scores.sort_values(kind='mergesort')
+
+def rank_dps(raidnights, method='min', difficulties=('Heroic',), weight=None, recency_half_life=14):
+    '''
+    Returns an ordered list of dps player names, from highest average dps rank across all bosses to lowest
+
+    Parameters:
+    raidnights: a RaidnightData object, a list of them (e.g. the raids within a single lockout),
+        or a long parse table such as SeasonAggregate.parse_table()
+    method, difficulties, weight, recency_half_life: as for dps_rank_scores
+    '''
+    return list(dps_rank_scores(raidnights, method, difficulties, weight, recency_half_life).index)
 
 def get_topn_dps_overall(raidnights, n=3):
     return rank_dps(raidnights)[:n]
@@ -61,44 +98,12 @@ def all_ilvl_parses_df(raidnights):
     Looks through the given raidnights, and returns a dataframe containing all dps players and their ilvl parses for each boss
 
     Parameters:
-        raidnights (list of RaidnightData objects)
+        raidnights (list of RaidnightData objects, or a long parse table)
 
-    
     Returns:
-        pandas dataframe, rows are players, columns are bosses, entries are ilvl parses
+        pandas dataframe, rows are (player, lockout), columns are bosses, entries are ilvl parses
     '''
-
-    # best way to construct? assign all bosses in all raidnights to column of dataframe?
-    # each row contains a unique player and lockout number?
-
-    # setup dataframe by finding all unique players&bosses in all raidnights
-    bosses = []
-    players = set()
-    lockouts = set()
-
-    for raidnight in raidnights:
-        lockouts.add(raidnight.get_raid_lockout_period())
-
-        for fight_name in raidnight.parse_scrapes.keys():
-            if fight_name not in bosses:
-                bosses.append(fight_name)
-
-            for player in raidnight.parse_scrapes[fight_name]:
-                players.add(player)
-
-    names_lockouts = pd.MultiIndex.from_product([players, lockouts], names=['Player', 'Lockout'])
-
-    df = pd.DataFrame(np.nan, index=names_lockouts,columns=bosses)
-
-    for raidnight in raidnights:
-        lockout = raidnight.get_raid_lockout_period()
-
-        for fight_name in raidnight.parse_scrapes.keys():
-            fight_dict = raidnight.parse_scrapes[fight_name]
-            for player in fight_dict.keys():
-                df.loc[(player, lockout), fight_name] = fight_dict[player]['ilvl-performance']
-
-    return df
+    return ilvl_parse_matrix(_parse_table(raidnights))
 
 def qualified_parses(parse_df):
     best_parses = parse_df.groupby(level='Player').max()
@@ -118,15 +123,16 @@ def unqualified_parses(parse_df):
 
 if __name__ == '__main__':
     raid_strings = ['CNMdqH1fDjGZAp8V', 'mJdfV7QjkC8avTWM']
-    raidnights = [RaidnightData(x, 'MyDudes') for x in raid_strings]
+    raidnights = [load_raidnight(x, 'MyDudes') for x in raid_strings]
     
     n = 5
     for raidnight in raidnights:
         print(f'Top {n} for raidnight {raidnight.wcl_string}:')
         print(get_topn_dps_overall(raidnight, n))
 
-    parse_df = all_ilvl_parses_df(raidnights)
+    # season-wide parses from the stored aggregate; only new or changed nights are read
+    parse_df = get_season_aggregate('MyDudes').ilvl_parse_matrix()
 
     #print(get_qualified_parses(parse_df))
 
-    print(unqualified_parses(parse_df))
\ No newline at end of file
+    print(unqualified_parses(parse_df))
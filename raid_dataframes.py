@@ -1,10 +1,9 @@
 import pandas as pd
-from os import listdir
-from os.path import isfile, join
-from raid_night_summarizer import Raidnight_Data
+from os.path import realpath
+from raid_catalog import NightStore, difficulty_dict, get_catalog
+from raid_sections import open_section_reader
 import datetime
 import numpy as np
-import re
 
 ordered_handles = {"Garothi Worldbreaker": 1,
             "Felhounds of Sargeras": 2,
@@ -18,59 +17,103 @@ ordered_handles = {"Garothi Worldbreaker": 1,
             "Aggramar": 10,
             "Argus the Unmaker": 11}
 
+# per-night rows of raidmetaframe, kept in the raid folder so each file is only read once
+METAFRAME_FILENAME = '.raid-metaframe.json'
+METAFRAME_VERSION = 1
+
+# {realpath of raid folder: (catalog signature, meta frame)}
+_metaframes = dict()
+
+def read_night_meta(filepath, sections=None):
+    '''
+    Reads the raidmetaframe fields of one raid file from its fights and damage-done sections only
+
+    Returns:
+    (dict): start and end (ms timestamps), average-ilevel (the best boss's average, or None)
+        and kills (the '[difficulty] [bossname]' of every kill, in kill order)
+    '''
+    section_reader = open_section_reader(filepath, sections, project=True)
+    fights = section_reader.read('fights')
+    damage_done = section_reader.read('damage-done')
+
+    top_average_ilevel = 0
+    for boss in damage_done:
+        try:
+            player_ilevels = [x['itemLevel'] for x in damage_done[boss]['entries']]
+        except KeyError:
+            continue
+        if not player_ilevels:
+            continue
+        average_ilevel = float(np.mean(player_ilevels))
+        if average_ilevel > top_average_ilevel:
+            top_average_ilevel = average_ilevel
+
+    kills = []
+    for fight in fights['fights']:
+        if fight.get('boss') and fight.get('kill') and fight.get('difficulty') in difficulty_dict:
+            boss = ' '.join([difficulty_dict[fight['difficulty']], fight['name']])
+            if boss not in kills:
+                kills.append(boss)
+
+    return {'start': fights['start'],
+            'end': fights['end'],
+            'average-ilevel': top_average_ilevel if top_average_ilevel != 0 else None,
+            'kills': kills}
+
+class NightMetaStore(NightStore):
+    # the per-night rows of raidmetaframe, read from each file's fights and damage-done sections
+    filename = METAFRAME_FILENAME
+    version = METAFRAME_VERSION
+
+    def read_night(self, code, entry):
+        return read_night_meta(get_catalog(self.raid_folder).path(code), entry['sections'])
+
 def raidmetaframe(raid_folder):
     '''
     Returns a dataframe for comparing all raidnights in a folder to each other
+
+    One row per night, indexed by wcl code in chronological order, with columns Date, Duration,
+    Lockout Number, Average ilevel (the best average item level seen on any boss) and a kill flag
+    for every '[difficulty] [bossname]'. Nights are read once and stored in the raid folder;
+    later calls only read files that are new or changed.
     '''
-    # currently contains: raidnight best avg ilvl seen
-    # TODO: Add columns for date, raid duration, bosses down
+    catalog = get_catalog(raid_folder)
+    signature = tuple((code, catalog.entries[code]['mtime'], catalog.entries[code]['size'],
+                       catalog.entries[code]['lockout'])
+                      for code in catalog.codes())
+    key = realpath(raid_folder)
+    cached = _metaframes.get(key)
+    if cached and cached[0] == signature:
+        return cached[1]
 
-    raidmetadict = {'Date': [],
-                    'Duration': [],
-                    'Lockout Number': [],
-                    'Average ilevel': []}
+    night_metas = NightMetaStore(raid_folder)
+    night_metas.refresh()
+    nights = night_metas.nights
 
     boss_diffs_and_names = []
     for diffstring in ['Normal', 'Heroic', 'Mythic']:
         for bossname in ordered_handles.keys():
             boss_diffs_and_names.append(' '.join([diffstring, bossname]))
-    
-    for bossdn in boss_diffs_and_names:
-        raidmetadict[bossdn] = []
-
-    for filename in [f for f in listdir(raid_folder) if isfile(join(raid_folder, f))]:
-        raidnight = Raidnight_Data(filename, raid_folder)
-
-        raiddate = pd.to_datetime(datetime.date.fromtimestamp(raidnight.raidnight_date))
-        raidmetadict['Date'].append(raiddate)
-
-        raidnight_duration = pd.to_timedelta(datetime.datetime.fromtimestamp(raidnight.fights['end']//1000) - datetime.datetime.fromtimestamp(raidnight.fights['start']//1000))
-        raidmetadict["Duration"].append(raidnight_duration)
-
-        raidmetadict["Lockout Number"].append(raidnight.get_raid_lockout_period())
-
-        top_average_ilevel = 0
-        for boss in raidnight.damage_done.keys():
-            try:
-                player_ilevels = [x['itemLevel'] for x in raidnight.damage_done[boss]['entries']]
-            except KeyError:
-                continue
-            average_ilevel = np.mean(player_ilevels)
-            if average_ilevel > top_average_ilevel:
-                top_average_ilevel = average_ilevel
-        
-        if top_average_ilevel != 0:
-            raidmetadict["Average ilevel"].append(top_average_ilevel)
-        else:
-            raidmetadict["Average ilevel"].append(None)
-        
-        for boss in boss_diffs_and_names:
-            if boss in raidnight.damage_done.keys():
-                raidmetadict[boss] = True
-            else:
-                raidmetadict[boss] = None
-
-    raidmetaframe = pd.DataFrame.from_dict(raidmetadict)
-    print(raidmetaframe.head(1))
-
-raidmetaframe('MyDudes')
\ No newline at end of file
+    # bosses of other raids follow, in order of first kill
+    for code in catalog.codes():
+        for boss in nights[code]['kills']:
+            if boss not in boss_diffs_and_names:
+                boss_diffs_and_names.append(boss)
+
+    codes = catalog.codes()
+    raidmetadict = {'Date': [pd.to_datetime(datetime.date.fromtimestamp(catalog.entries[code]['date']))
+                             for code in codes],
+                    'Duration': [pd.to_timedelta(nights[code]['end']//1000 - nights[code]['start']//1000, unit='s')
+                                 for code in codes],
+                    'Lockout Number': [catalog.entries[code]['lockout'] for code in codes],
+                    'Average ilevel': [nights[code]['average-ilevel'] for code in codes]}
+    kill_sets = [set(nights[code]['kills']) for code in codes]
+    for boss in boss_diffs_and_names:
+        raidmetadict[boss] = [boss in kills for kills in kill_sets]
+
+    metaframe = pd.DataFrame(raidmetadict, index=pd.Index(codes, name='Code'))
+    _metaframes[key] = (signature, metaframe)
+    return metaframe
+
+if __name__ == '__main__':
+    print(raidmetaframe('MyDudes').head(1))
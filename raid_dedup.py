@@ -0,0 +1,184 @@
+""" Content-addressed storage of the gear and talents of raid files
+
+Every damage-done and healing entry carries the player's full gear (18 items) and talents,
+and these are the same in every kill of a night, and in the damage-done and healing tables
+alike. A deduplicated raid file keeps each distinct gear set and talent build once, in a
+'shared-blobs' section of form {field: {id: value}}, and each entry holds the id (a hash of
+the value) in place of the value.
+
+Expanding restores the original shape exactly. Entries of an expanded night share one object
+per distinct value, so a loaded night only holds each gear set once in memory too. Abilities,
+pets and targets are left alone: they carry per-fight totals and never repeat.
+
+New raid files are only written deduplicated when RaidnightData.deduplicate is set; existing
+folders are converted with rewrite_folder. -check verifies that every file of a folder comes
+back unchanged from a round trip, without rewriting anything.
+
+Usage:
+    python raid_dedup.py MyDudes [-expand] [-check]
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import sys
+from os import listdir
+from os.path import getsize, join
+
+from raid_compression import RAID_JSON_EXTENSIONS, dump_json, load_json
+
+BLOBS_SECTION = 'shared-blobs'
+# fields of the entries of these sections that are stored once per night
+deduplicated_sections = ('damage-done', 'healing')
+shared_fields = ('gear', 'talents')
+
+
+def blob_id(value):
+    """
+    Returns the content address of a json value
+    """
+    encoded = json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def is_deduplicated(file_dict):
+    return BLOBS_SECTION in file_dict
+
+
+def deduplicate(file_dict):
+    """
+    Returns a copy of a raid json dictionary with shared_fields replaced by ids into a blobs section
+
+    Tables and entries are copied; the values themselves are shared with file_dict.
+    """
+    if is_deduplicated(file_dict):
+        return file_dict
+    blobs = {field: dict() for field in shared_fields}
+    deduplicated = dict()
+    for key, section in file_dict.items():
+        if key not in deduplicated_sections:
+            deduplicated[key] = section
+            continue
+        deduplicated[key] = dict()
+        for fight_name, table in section.items():
+            entries = []
+            for entry in table.get('entries', []):
+                entry = dict(entry)
+                for field in shared_fields:
+                    if field in entry:
+                        value_id = blob_id(entry[field])
+                        blobs[field].setdefault(value_id, entry[field])
+                        entry[field] = value_id
+                entries.append(entry)
+            deduplicated[key][fight_name] = dict(table, entries=entries) if 'entries' in table else table
+    deduplicated[BLOBS_SECTION] = blobs
+    return deduplicated
+
+
+def expand_section(section, blobs, copy_values=False):
+    """
+    Returns a damage-done or healing section with the ids of its entries replaced by their values
+    """
+    expanded = dict()
+    for fight_name, table in section.items():
+        if 'entries' not in table:
+            expanded[fight_name] = table
+            continue
+        entries = []
+        for entry in table['entries']:
+            for field in shared_fields:
+                if isinstance(entry.get(field), str):
+                    value = blobs[field][entry[field]]
+                    entry[field] = copy.deepcopy(value) if copy_values else value
+            entries.append(entry)
+        expanded[fight_name] = dict(table, entries=entries)
+    return expanded
+
+
+def expand(file_dict, copy_values=False):
+    """
+    Restores the original shape of a deduplicated raid json dictionary (others are returned as they are)
+
+    Entries are updated in place. Parameters:
+    copy_values (bool): give every entry its own copy of each value instead of a shared one
+    """
+    if not is_deduplicated(file_dict):
+        return file_dict
+    blobs = file_dict[BLOBS_SECTION]
+    return {key: expand_section(section, blobs, copy_values) if key in deduplicated_sections else section
+            for key, section in file_dict.items() if key != BLOBS_SECTION}
+
+
+def check_round_trip(file_dict):
+    """
+    Returns True if a raid json dictionary is unchanged by deduplicating and expanding it
+
+    Deduplicated dictionaries are checked the other way round, expanding then deduplicating.
+    """
+    if is_deduplicated(file_dict):
+        return deduplicate(expand(copy.deepcopy(file_dict))) == file_dict
+    return expand(deduplicate(file_dict)) == file_dict
+
+
+def _raid_json_filenames(raid_folder):
+    return [filename for filename in sorted(listdir(raid_folder))
+            if any(filename.endswith(')' + extension) for extension in RAID_JSON_EXTENSIONS)]
+
+
+def check_folder(raid_folder):
+    """
+    Checks the round trip of every raid json file in a folder
+
+    Returns:
+    (list): the paths of the files that did not come back unchanged
+    """
+    failed = []
+    for filename in _raid_json_filenames(raid_folder):
+        path = join(raid_folder, filename)
+        if not check_round_trip(load_json(path)):
+            failed.append(path)
+            print(f'{filename}: changed by the round trip')
+    return failed
+
+
+def rewrite_folder(raid_folder, expand_files=False):
+    """
+    Deduplicates (or expands) every raid json file in a folder in place, keeping its compression
+
+    Returns:
+    (list): (path, original size, new size) for every rewritten file
+    """
+    rewritten = []
+    for filename in _raid_json_filenames(raid_folder):
+        path = join(raid_folder, filename)
+        file_dict = load_json(path)
+        if is_deduplicated(file_dict) != expand_files:
+            continue
+        original_size = getsize(path)
+        dump_json(expand(file_dict) if expand_files else deduplicate(file_dict), path)
+        rewritten.append((path, original_size, getsize(path)))
+        print(f'{filename}: {original_size/1e6:.1f}MB -> {getsize(path)/1e6:.1f}MB')
+    return rewritten
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Store the gear and talents of raid json files once per night')
+    parser.add_argument('raid_folder', type=str,
+                        help="the directory containing raid json files")
+    parser.add_argument('-expand', action='store_true',
+                        help="restore the original files instead")
+    parser.add_argument('-check', action='store_true',
+                        help="only check that every file survives a round trip unchanged")
+    args = parser.parse_args()
+
+    if args.check:
+        failed = check_folder(args.raid_folder)
+        print(f'{len(failed)} files changed by the round trip')
+        sys.exit(1 if failed else 0)
+
+    rewritten = rewrite_folder(args.raid_folder, args.expand)
+    before = sum(original_size for _, original_size, _ in rewritten)
+    after = sum(new_size for _, _, new_size in rewritten)
+    if rewritten:
+        print(f'{len(rewritten)} files: {before/1e6:.1f}MB -> {after/1e6:.1f}MB')
@@ -1,28 +1,28 @@
 """ This script is intended to be the base for a comprehensive raid night summarizer """
 
 import datetime
-import json
+import heapq
+import numpy as np
 import pandas as pd
 import re
-from os import listdir, pardir, mkdir
-from os.path import isfile, join, isdir
-from collections import defaultdict
-from numpy import mean
+from collections import OrderedDict
+from os import mkdir
+from os.path import join, isdir, realpath
+from numpy import mean, nan
 
 from API_keys import wcl_api_key
-from get_wcl_api import get_wcl_api_fights, get_wcl_api_table
-from scrape_parse_data import scrape_damage_parse_data
+from get_wcl_api import get_wcl_api_fights, use_response_cache
+from raid_catalog import difficulty_dict, get_catalog
+from raid_compression import dump_json, with_compression
+from raid_dedup import deduplicate
+from raid_records import convert_deaths, convert_fights, convert_parse_scrapes, convert_player_tables
+from report_checkpoints import ReportCheckpoint
+from raid_sections import LazySection, load_raid_file, open_section_reader
+from scrape_parse_data import BrowserPool
+from wcl_fetch import DEFAULT_MAX_WORKERS, DEFAULT_REQUESTS_PER_SECOND, fetch_report_tables
+from wcl_zones import get_zone_name_from_id, get_lockout_period
 
 
-def get_zone_name_from_id(zoneid, basedir):
-    with open(join(basedir, pardir, 'zones.json'), 'r') as open_file:
-        zones_dict = json.load(open_file)
-    for entry in zones_dict:
-        if entry['id'] == zoneid:
-            return entry['name']
-
-    return 'unknown'
-
 # This class holds all information for a raid night
 class RaidnightData():
     """This class contains all pertinent data for a raidnight as found on warcraftlogs (wcl)
@@ -37,58 +37,92 @@ class RaidnightData():
         healing: The aggregate dictionary of wcl healing tables (kills only)
         deaths: The aggregate dictionary of wcl deaths tables (kills & wipes)
         parse_scrapes: The aggregate dictionary of wcl damage parse scrapes
+        analysis_cache: memoized results of analyses over this raidnight
         wipes: a dictionary of form {bossname: number}
         raidnight_date: a unix timestamp
+
+    With lazy=True, a raidnight loaded from file only parses the sections it uses
+    With refresh=True, the report is fetched from wcl even if a file exists; fights already
+    checkpointed in the raid folder are not fetched again, so only new fights are downloaded
         """
 
     API_key = wcl_api_key()
-    difficulty_dict = {1: "Raid-Finder",
-                       2: "Flex",
-                       3: "Normal",
-                       4: "Heroic"}
-
-    def __init__(self, initializationdata, raid_folder):
-        # Search working directory for matching filename
+    difficulty_dict = difficulty_dict
+
+    # concurrency and rate limit for the per-fight wcl table requests (see wcl_fetch)
+    fetch_max_workers = DEFAULT_MAX_WORKERS
+    fetch_requests_per_second = DEFAULT_REQUESTS_PER_SECOND
+    # number of headless browsers used to scrape parses (see scrape_parse_data.BrowserPool)
+    scrape_browsers = 2
+    # keep wcl responses in the raid folder so a report is only downloaded once (see wcl_cache)
+    cache_responses = True
+    # 'gzip' or 'zstd' to write new raid files compressed (see raid_compression)
+    compression = None
+    # store the gear and talents of new raid files once per night (see raid_dedup); off by
+    # default, since readers outside raid_sections and raid_stream expect the full entries
+    deduplicate = False
+
+    # in lazy mode these are only read from the raid file when first accessed;
+    # either way they are held as records (see raid_records)
+    fights = LazySection('fights', convert_fights)
+    damage_done = LazySection('damage-done', convert_player_tables)
+    healing = LazySection('healing', convert_player_tables)
+    deaths = LazySection('deaths', convert_deaths)
+    parse_scrapes = LazySection('parse-scrapes', convert_parse_scrapes)
+
+    def __init__(self, initializationdata, raid_folder, lazy=False, refresh=False):
+        # results of analyses over this raidnight, e.g. differential_parse_data
+        self.analysis_cache = dict()
+
+        # Search the raid folder's catalog for matching filename
         self.raid_folder = raid_folder
         if not isdir(raid_folder):
             mkdir(raid_folder)
-        for filename in [join(raid_folder, f) for f in listdir(raid_folder) if isfile(join(raid_folder, f))]:
-            if re.search(re.escape(initializationdata), filename):
-                with open(filename, 'r') as open_file:
-                    file_dict = json.load(open_file)
-                    print(filename)
-                    self.wcl_string = re.search(r'\(.+\)', filename).group()[1:-1]
-                    print(self.wcl_string)
-                    self.damage_done = file_dict['damage-done']
-                    self.healing = file_dict['healing']
-                    self.deaths = file_dict['deaths']
-                    self.fights = file_dict['fights']
-                    self.wipes = file_dict['wipes']
-                    self.parse_scrapes = file_dict['parse-scrapes']
-                    self.raidnight_date = file_dict['raidnight-date']
-                    self.raid_name = file_dict['raid-name']
-                    self.raid_difficulty = file_dict['raid-difficulty']
-                    zone_name = '_'.join(get_zone_name_from_id(
-                        self.fights['zone'], raid_folder).replace(",", "").split(' '))
-                    self.raidnight_date = self.fights['start']//1000
-                    raidnight_date_string = datetime.date.fromtimestamp(
-                        self.raidnight_date).strftime("%y-%m-%d")
-                    highest_difficulty = 1
-                    for fight in self.fights['fights']:
-                        try:
-                            if fight['difficulty'] and fight['difficulty'] > highest_difficulty:
-                                highest_difficulty = fight['difficulty']
-                        except KeyError:
-                            pass
-                    fight_difficulty_string = RaidnightData.difficulty_dict[highest_difficulty]
-                    self.raid_difficulty = fight_difficulty_string
-                    self.name = '-'.join([zone_name,
-                                          fight_difficulty_string, raidnight_date_string])
-                return
+        catalog = get_catalog(raid_folder)
+        wcl_code = catalog.find_code(initializationdata)
+        if wcl_code and not refresh:
+            filename = catalog.path(wcl_code)
+            print(filename)
+            self.wcl_string = re.search(r'\(.+\)', filename).group()[1:-1]
+            print(self.wcl_string)
+            if lazy:
+                # fights, damage-done, healing, deaths and parse-scrapes are read on first access,
+                # keeping only the player entry fields used here (see raid_stream)
+                self._section_reader = open_section_reader(filename, catalog.get(wcl_code)['sections'], project=True)
+                self.wipes = self._section_reader.read('wipes')
+                self.raid_name = self._section_reader.read('raid-name')
+            else:
+                file_dict = load_raid_file(filename, project=True)
+                self.damage_done = convert_player_tables(file_dict['damage-done'])
+                self.healing = convert_player_tables(file_dict['healing'])
+                self.deaths = convert_deaths(file_dict['deaths'])
+                self.fights = convert_fights(file_dict['fights'])
+                self.wipes = file_dict['wipes']
+                self.parse_scrapes = convert_parse_scrapes(file_dict['parse-scrapes'])
+                self.raid_name = file_dict['raid-name']
+            zone_name = '_'.join(get_zone_name_from_id(
+                self.fights['zone'], raid_folder).replace(",", "").split(' '))
+            self.raidnight_date = self.fights['start']//1000
+            raidnight_date_string = datetime.date.fromtimestamp(
+                self.raidnight_date).strftime("%y-%m-%d")
+            highest_difficulty = 1
+            for fight in self.fights['fights']:
+                try:
+                    if fight['difficulty'] and fight['difficulty'] > highest_difficulty:
+                        highest_difficulty = fight['difficulty']
+                except KeyError:
+                    pass
+            fight_difficulty_string = RaidnightData.difficulty_dict[highest_difficulty]
+            self.raid_difficulty = fight_difficulty_string
+            self.name = '-'.join([zone_name,
+                                  fight_difficulty_string, raidnight_date_string])
+            return
 
         # Continue to wcl api for data if no matching filename
         print("Initializing from wcl api...")
         self.wcl_string = initializationdata
+        if RaidnightData.cache_responses:
+            use_response_cache(raid_folder)
 
         # API call for fights
         rstring = ''.join(
@@ -124,6 +158,21 @@ class RaidnightData():
         self.deaths = dict()
         self.parse_scrapes = dict()
 
+        # query deaths (all pulls), damage-done and healing (kills) for every fight at once
+        # results are checkpointed per fight, so a rerun only fetches what is missing
+        checkpoint = ReportCheckpoint(raid_folder, self.wcl_string)
+        fight_tables = fetch_report_tables(self.wcl_string, self.fights['fights'], RaidnightData.API_key,
+                                           RaidnightData.fetch_max_workers, RaidnightData.fetch_requests_per_second,
+                                           checkpoint)
+
+        # scrape parse data for every kill from the wcl website in one browser session
+        kill_ids = [fight['id'] for fight in self.fights['fights'] if fight['boss'] and fight['kill']]
+        fight_parse_scrapes = checkpoint.load_all(kill_ids, 'parse-scrapes')
+        with BrowserPool(RaidnightData.scrape_browsers) as browser_pool:
+            fight_parse_scrapes.update(browser_pool.scrape_many(
+                self.wcl_string, [fight_id for fight_id in kill_ids if fight_id not in fight_parse_scrapes],
+                on_result=lambda fight_id, parse_scrape: checkpoint.save(fight_id, 'parse-scrapes', parse_scrape)))
+
         # add data for each fight under '[difficulty] [bossname]' in appropriate dictionary (for kill-only categories)
         # '[difficulty] [bossname] [number]' for all-pull categories like deaths
         for fight in self.fights['fights']:
@@ -135,14 +184,7 @@ class RaidnightData():
                 [temp_fight_name, str(fight['id'])])
             print(temp_fight_name_with_id)
 
-            # the common query string in api call for this fight
-            fight_api_call_string = ''.join(["/", self.wcl_string, "?start=", str(
-                fight['start_time']), "&end=", str(fight['end_time']), "&api_key=", RaidnightData.API_key])
-
-            # query deaths in fight
-            temp_deaths_dict = get_wcl_api_table(
-                "deaths"+fight_api_call_string)
-            self.deaths[temp_fight_name_with_id] = temp_deaths_dict
+            self.deaths[temp_fight_name_with_id] = fight_tables[(fight['id'], 'deaths')]
 
             # skip remaining entries for wipes
             if not fight['kill']:
@@ -152,18 +194,10 @@ class RaidnightData():
                     self.wipes[temp_fight_name] += 1
                 continue
 
-            # scrape parse data from wcl website
-            self.parse_scrapes[temp_fight_name] = scrape_damage_parse_data(
-                self.wcl_string, fight['id'])
-
-            # query damage-done and healing
-            temp_damage_dict = get_wcl_api_table(
-                "damage-done"+fight_api_call_string)
-            temp_healing_dict = get_wcl_api_table(
-                "healing"+fight_api_call_string)
+            self.parse_scrapes[temp_fight_name] = fight_parse_scrapes[fight['id']]
 
-            self.damage_done[temp_fight_name] = temp_damage_dict
-            self.healing[temp_fight_name] = temp_healing_dict
+            self.damage_done[temp_fight_name] = fight_tables[(fight['id'], 'damage-done')]
+            self.healing[temp_fight_name] = fight_tables[(fight['id'], 'healing')]
 
         # save dictionary to file for later access
         writedict = {'fights': self.fights,
@@ -175,9 +209,20 @@ class RaidnightData():
                      'raidnight-date': self.raidnight_date,
                      'raid-name': self.raid_name,
                      'raid-difficulty': self.raid_difficulty}
-        with open(join(raid_folder, self.name+'('+initializationdata+').json'), 'w') as open_file:
-            print("Writing to file...")
-            json.dump(writedict, open_file, indent=4)
+        out_path = with_compression(join(raid_folder, self.name+'('+initializationdata+').json'),
+                                    RaidnightData.compression)
+        if RaidnightData.deduplicate:
+            writedict = deduplicate(writedict)
+        print("Writing to file...")
+        dump_json(writedict, out_path, RaidnightData.compression)
+        get_catalog(raid_folder).update_file(out_path)
+
+        # held as records from here on, as when loaded from the file
+        self.fights = convert_fights(self.fights)
+        self.damage_done = convert_player_tables(self.damage_done)
+        self.healing = convert_player_tables(self.healing)
+        self.deaths = convert_deaths(self.deaths)
+        self.parse_scrapes = convert_parse_scrapes(self.parse_scrapes)
     
     def export_csv(self):
         #make a dictionary that is easily convertable to a dataframe
@@ -207,30 +252,68 @@ class RaidnightData():
     def get_name(self):
         return self.name
 
+    def clear_analysis_cache(self):
+        self.analysis_cache = dict()
+
     def get_fight_time(self, boss_diff_and_name):
         # in milliseconds
         return self.damage_done[boss_diff_and_name]['totalTime']
 
+    def player_frame(self):
+        """
+        Gets the night's kills as a table with one row per (fight, player)
+
+        Columns: fight, fight_time (ms), player, spec, ilvl, damage, dps, hps, overall_parse,
+        ilvl_parse, died. damage is the player's total, for ranking without dps's rounding.
+        damage, dps, hps and the parses are NaN where the player has no entry in that table.
+        The frame is built once and kept in analysis_cache.
+
+        Returns:
+        (pandas.DataFrame)
+        """
+        if 'player-frame' not in self.analysis_cache:
+            self.analysis_cache['player-frame'] = self._build_player_frame()
+        return self.analysis_cache['player-frame']
+
+    def _build_player_frame(self):
+        rows = dict()
+
+        def fight_player_row(boss, player_name):
+            if (boss, player_name) not in rows:
+                rows[(boss, player_name)] = {'fight': boss, 'fight_time': self.get_fight_time(boss),
+                                             'player': player_name, 'spec': None, 'ilvl': nan,
+                                             'damage': nan, 'dps': nan, 'hps': nan, 'overall_parse': nan, 'ilvl_parse': nan}
+            return rows[(boss, player_name)]
+
+        for table, column in [(self.damage_done, 'dps'), (self.healing, 'hps')]:
+            for boss in table:
+                fight_time = self.get_fight_time(boss)  # in milliseconds
+                for entry in table[boss]['entries']:
+                    row = fight_player_row(boss, entry.name)
+                    row[column] = entry.get_dps(fight_time)
+                    if column == 'dps':
+                        row['damage'] = entry.total
+                    if row['spec'] is None:
+                        row['spec'] = entry.icon
+                        row['ilvl'] = entry.item_level if entry.item_level is not None else nan
+
+        for boss in self.parse_scrapes:
+            for player_name, parse in self.parse_scrapes[boss].items():
+                row = fight_player_row(boss, player_name)
+                row['overall_parse'] = parse.overall
+                row['ilvl_parse'] = parse.ilvl
+
+        frame = pd.DataFrame(list(rows.values()),
+                             columns=['fight', 'fight_time', 'player', 'spec', 'ilvl',
+                                      'damage', 'dps', 'hps', 'overall_parse', 'ilvl_parse'])
+        nonwipe_deaths = self.get_nonwipe_deaths()
+        frame['died'] = [player_name in nonwipe_deaths.get(boss, ())
+                         for boss, player_name in zip(frame['fight'], frame['player'])]
+        return frame
+
     # return a set of tuples (playername, dps/hps,[ilvl parse,] bossname, fightduration (ms))
     def get_set(self, set_type):
-        return_set = set()
-        data_location = {'dps': self.damage_done,
-                         'hps': self.healing,
-                         'dps_parse': self.parse_scrapes}[set_type]
-
-        for boss in data_location:
-            fight_time = self.get_fight_time(boss)  # in milliseconds
-            # dps/hps format
-            if set_type != 'dps_parse':
-                for entry in data_location[boss]['entries']:
-                    return_set.add(
-                        (entry['name'], int(entry['total']/fight_time*1000), boss, fight_time))
-            # parses format
-            else:
-                for entry in data_location[boss]:
-                    return_set.add((entry, data_location[boss][entry]['overall-performance'],
-                                    data_location[boss][entry]['ilvl-performance'], boss, fight_time))
-        return return_set
+        return set(frame_tuples(self.player_frame(), set_type))
 
     def dps_set(self):
         return self.get_set('dps')
@@ -242,35 +325,22 @@ class RaidnightData():
         return self.get_set('dps_parse')
 
     def raid_average_parse_set(self):
-        return_set = set()
-        for boss in self.parse_scrapes:
-            average_overall_parse = sum([self.parse_scrapes[boss][x]['overall-performance']
-                                         for x in self.parse_scrapes[boss]])/len(self.parse_scrapes[boss])
-            average_ilvl_parse = sum([self.parse_scrapes[boss][x]['ilvl-performance']
-                                      for x in self.parse_scrapes[boss]])/len(self.parse_scrapes[boss])
-            return_set.add((boss, average_overall_parse, average_ilvl_parse))
-        return return_set
+        return set(frame_tuples(self.player_frame(), 'raid_average_parse'))
 
     # returns a dict[playername]:death_count
     def deaths_dict(self):
         all_deaths = dict()
         for fight in self.deaths:
-            for entry in self.deaths[fight]['entries']:
-                player_who_died = entry['name']
-                if player_who_died not in all_deaths:
-                    all_deaths[player_who_died] = 1
-                else:
-                    all_deaths[player_who_died] += 1
+            for death in self.deaths[fight]['entries']:
+                all_deaths[death.name] = all_deaths.get(death.name, 0) + 1
         return all_deaths
 
     # returns dps for a given player and boss as an int
     def get_dps(self, player_name, boss_diff_and_name):
-        fight_duration = self.damage_done[boss_diff_and_name]['totalTime']
-        for entry in self.damage_done[boss_diff_and_name]['entries']:
-            if entry['name'] == player_name:
-                return int(entry['total']/fight_duration*1000)
-
-        return 0
+        if 'dps-lookup' not in self.analysis_cache:
+            self.analysis_cache['dps-lookup'] = {(player, boss): dps for player, dps, boss, _
+                                                 in frame_tuples(self.player_frame(), 'dps')}
+        return self.analysis_cache['dps-lookup'].get((player_name, boss_diff_and_name), 0)
 
     def get_raid_lockout_period(self):
         """
@@ -281,15 +351,7 @@ class RaidnightData():
         Returns:
         (int)
         """
-        with open(join(self.raid_folder, pardir, 'raid-release-dates.json'), 'r') as open_file:
-            raid_release_timestamps = json.load(open_file)
-        raid_name = get_zone_name_from_id(
-            self.fights['zone'],
-            self.raid_folder)
-        raid_release_date = raid_release_timestamps[raid_name]
-        days_since_release = datetime.date.fromtimestamp(
-            self.raidnight_date) - datetime.date.fromtimestamp(raid_release_date)
-        return days_since_release.days//7
+        return get_lockout_period(self.fights['zone'], self.raidnight_date, self.raid_folder)
 
     def get_raid_duration(self):
         """
@@ -314,7 +376,7 @@ class RaidnightData():
     def get_kill_count(self):
         kill_count = 0
         for fight in self.fights['fights']:
-            if fight['boss'] and fight['kill']:
+            if fight.boss and fight.kill:
                 kill_count += 1
         return kill_count
 
@@ -322,18 +384,15 @@ class RaidnightData():
         # dict format should be [bossname]: [player1, player2, player3]
         nonwipe_deaths_dict = dict()
         for fight in self.fights['fights']:
-            try:
-                if not fight['kill']:
-                    continue
-            except KeyError:
+            if not fight.kill:
                 continue
             player_death_list = []
             deathdict_id = ' '.join(
-                [RaidnightData.difficulty_dict[fight['difficulty']], fight['name'], f"{fight['id']}"])
-            for entry in self.deaths[deathdict_id]['entries']:
-                player_death_list.append(entry['name'])
+                [RaidnightData.difficulty_dict[fight.difficulty], fight.name, f"{fight.id}"])
+            for death in self.deaths[deathdict_id]['entries']:
+                player_death_list.append(death.name)
             nonwipe_deathdict_id = ' '.join(
-                [RaidnightData.difficulty_dict[fight['difficulty']], fight['name']])
+                [RaidnightData.difficulty_dict[fight.difficulty], fight.name])
             nonwipe_deaths_dict[nonwipe_deathdict_id] = player_death_list
         return nonwipe_deaths_dict
     
@@ -355,6 +414,9 @@ def differential_parse_dict(raidnight_object, raid_folder):
     """
     Constructs a dictionary for comparing this week's parses to last week's
 
+    Note that this adds the historical and differential fields to raidnight_object.parse_scrapes
+    in place; use differential_parse_data for a version that leaves the raidnight untouched.
+
     Parameters:
     raidnight_object (RaidnightData): The current week's RaidnightData
     raid_folder (string): the directory to scan for last week's RaidnightData object(s)
@@ -372,9 +434,44 @@ def differential_parse_dict(raidnight_object, raid_folder):
             [boss 2]
                 [character name]
     """
+    parse_dict, player_averages = differential_parse_data(raidnight_object, raid_folder)
+    for boss_diff_and_name in parse_dict:
+        for player_name in parse_dict[boss_diff_and_name]:
+            raidnight_object.parse_scrapes[boss_diff_and_name][player_name].update(
+                parse_dict[boss_diff_and_name][player_name])
+
+    return raidnight_object.parse_scrapes, player_averages
+
+
+def differential_parse_data(raidnight_object, raid_folder):
+    """
+    Non-mutating, memoized version of differential_parse_dict
 
-    this_weeks_parse_dict = raidnight_object.parse_scrapes
-    raids_list = get_prior_week_data(raidnight_object, raid_folder)
+    The comparison is computed once per raidnight and stored in its analysis_cache; it is
+    recomputed only when the prior week's raid files in raid_folder change. The returned
+    dictionaries are shared between callers and must not be modified.
+
+    Returns:
+    (tuple): (copy of parse_scrapes with differential fields, player_averages)
+    """
+    catalog = get_catalog(raid_folder)
+    prior_codes = catalog.codes_in_lockout(raidnight_object.raid_name,
+                                           raidnight_object.get_raid_lockout_period() - 1)
+    folder_signature = tuple((code, catalog.get(code)['mtime']) for code in prior_codes)
+
+    cache_key = ('parse-differential', realpath(raid_folder))
+    cached = raidnight_object.analysis_cache.get(cache_key)
+    if cached and cached[0] == folder_signature:
+        return cached[1]
+
+    result = _compute_parse_differentials(raidnight_object, get_prior_week_data(raidnight_object, raid_folder))
+    raidnight_object.analysis_cache[cache_key] = (folder_signature, result)
+    return result
+
+
+def _compute_parse_differentials(raidnight_object, raids_list):
+    this_weeks_parse_dict = {boss: {player: dict(parse) for player, parse in players.items()}
+                             for boss, players in raidnight_object.parse_scrapes.items()}
     prior_parse_dicts = [f.parse_scrapes for f in raids_list]
     prior_simple_death_dicts = [f.get_nonwipe_deaths() for f in raids_list]
     combined_prior_parse_dict = dict()
@@ -459,30 +556,120 @@ def differential_parse_dict(raidnight_object, raid_folder):
     return this_weeks_parse_dict, player_averages
 
 
-def get_best(raidnight_object, metric, get_amount):
+# (columns of each tuple, column that must be present) for the tuple formats of RaidnightData.get_set
+frame_tuple_formats = {'dps': (['player', 'dps', 'fight', 'fight_time'], 'dps'),
+                       'hps': (['player', 'hps', 'fight', 'fight_time'], 'hps'),
+                       'dps_parse': (['player', 'overall_parse', 'ilvl_parse', 'fight', 'fight_time'], 'overall_parse')}
+
+
+def frame_tuples(frame, set_type):
+    """
+    Converts rows of a player frame to the tuple formats used by get_set and get_best
+
+    Parameters:
+    frame (pandas.DataFrame): a RaidnightData.player_frame(), possibly sorted or sliced
+    set_type (str): one of ['dps', 'hps', 'dps_parse', 'raid_average_parse']
+
+    Returns:
+    (list): tuples in frame order, numbers as python ints (floats for raid averages)
+    """
+    if set_type == 'raid_average_parse':
+        averages = frame.dropna(subset=['overall_parse']).groupby('fight', sort=False)[
+            ['overall_parse', 'ilvl_parse']].mean()
+        return list(zip(averages.index.tolist(), averages['overall_parse'].tolist(),
+                        averages['ilvl_parse'].tolist()))
+
+    columns, required_column = frame_tuple_formats[set_type]
+    frame = frame[frame[required_column].notna()]
+    column_values = [frame[column].tolist() for column in columns]
+    return [tuple(int(value) if column not in ['player', 'fight'] else value
+                  for column, value in zip(columns, row))
+            for row in zip(*column_values)]
+
+
+def top_k_indices(values, k):
     """
-    Returns a sorted set of tuples representing the best-in-class performance for the raid night
+    Returns the positions of the k largest values, largest first
+
+    Runs in O(n) plus a sort of the k winners (numpy argpartition). Equal values keep
+    their original order, including at the cut-off, so the result is deterministic.
+
+    Parameters:
+    values (array-like): numbers to rank
+    k (int): how many positions to return
+
+    Returns:
+    (numpy.ndarray): integer positions into values
+    """
+    values = np.asarray(values, dtype=float)
+    if k <= 0 or len(values) == 0:
+        return np.zeros(0, dtype=int)
+    if k < len(values):
+        # everything tied with the k-th largest value stays a candidate
+        threshold = values[np.argpartition(-values, k - 1)[k - 1]]
+        candidates = np.flatnonzero(values >= threshold)
+    else:
+        candidates = np.arange(len(values))
+    # sort by value descending, then position ascending
+    order = np.lexsort((candidates, -values[candidates]))
+    return candidates[order][:k]
+
+
+# metric: (column ranked, tuple format) for the per-player metrics of get_best
+best_metric_columns = {'dps': ('dps', 'dps'),
+                       'hps': ('hps', 'hps'),
+                       'overall-parse': ('overall_parse', 'dps_parse'),
+                       'ilvl-parse': ('ilvl_parse', 'dps_parse')}
+
+
+def get_best_many(raidnight_object, metric_amounts):
+    """
+    Computes several best-in-class rankings for a raid night in one pass over its player frame
 
     Parameters:
     raidnight_object (RaidnightData): the raidnight to be analyzed
-    metric (str): one of ['dps', 'overall-parse', 'ilvl-parse', 'hps', 'raid-overall-parse']
+    metric_amounts (dict): {metric: get_amount}, metrics as for get_best
+
+    Returns:
+    (dict): {metric: list of tuples, best first}
     """
+    frame = raidnight_object.player_frame()
+    rankings = dict()
+    candidate_frames = dict()
+    raid_averages = None
+
+    for metric, get_amount in metric_amounts.items():
+        if metric in ['raid-overall-parse', 'raid-ilvl-parse']:
+            if raid_averages is None:
+                raid_averages = frame_tuples(frame, 'raid_average_parse')
+            sort_index = 1 if metric == 'raid-overall-parse' else 2
+            rankings[metric] = [raid_averages[i] for i in
+                                top_k_indices([y[sort_index] for y in raid_averages], get_amount)]
+            continue
 
+        sort_column, set_type = best_metric_columns[metric]
+        # overall-parse and ilvl-parse share one set of candidate rows
+        if set_type not in candidate_frames:
+            columns, required_column = frame_tuple_formats[set_type]
+            candidate_frames[set_type] = frame[frame[required_column].notna()].drop_duplicates(subset=columns)
+        candidates = candidate_frames[set_type]
+        ranked = candidates.iloc[top_k_indices(candidates[sort_column].to_numpy(), get_amount)]
+        rankings[metric] = frame_tuples(ranked, set_type)
 
-    metric_switch = {'dps': lambda x: sorted(raidnight_object.dps_set(), \
-                                        key=lambda y: y[1], reverse=True)[:x],
-                     'overall-parse': lambda x: sorted(raidnight_object.dps_parse_set(), \
-                                        key=lambda y: y[1], reverse=True)[:x],
-                     'ilvl-parse': lambda x: sorted(raidnight_object.dps_parse_set(), \
-                                        key=lambda y: y[2], reverse=True)[:x],
-                     'hps': lambda x: sorted(raidnight_object.hps_set(), \
-                                        key=lambda y: y[1], reverse=True)[:x],
-                     'raid-overall-parse': lambda x: sorted(raidnight_object.raid_average_parse_set(), \
-                                        key=lambda y: y[1], reverse=True)[:x],
-                     'raid-ilvl-parse': lambda x: sorted(raidnight_object.raid_average_parse_set(), \
-                                        key=lambda y: y[2], reverse=True)[:x]}
+    return rankings
 
-    return metric_switch[metric](get_amount)
+
+def get_best(raidnight_object, metric, get_amount):
+    """
+    Returns a sorted list of tuples representing the best-in-class performance for the raid night
+
+    Ties keep the player frame's row order (fight order, then table order).
+
+    Parameters:
+    raidnight_object (RaidnightData): the raidnight to be analyzed
+    metric (str): one of ['dps', 'overall-parse', 'ilvl-parse', 'hps', 'raid-overall-parse', 'raid-ilvl-parse']
+    """
+    return get_best_many(raidnight_object, {metric: get_amount})[metric]
 
 
 def get_best_dps(raidnight_object, get_amount):
@@ -510,16 +697,17 @@ def get_best_raid_ilvl_parse(raidnight_object, get_amount):
 
 
 def get_best_parse_differential(raidnight_object, raid_folder, get_amount, parse_type):
-    parse_dict, _ = differential_parse_dict(raidnight_object, raid_folder)
-    overall_difference_set = set()
+    parse_dict, _ = differential_parse_data(raidnight_object, raid_folder)
+    overall_difference_list = []
     for boss in parse_dict:
         for player in parse_dict[boss]:
             try:
-                overall_difference_set.add((player, parse_dict[boss][player][parse_type + '-difference'], boss, parse_dict[boss]
-                                            [player][parse_type + '-performance'], parse_dict[boss][player]['last-weeks-'+parse_type+'-performance']))
+                overall_difference_list.append((player, parse_dict[boss][player][parse_type + '-difference'], boss, parse_dict[boss]
+                                                [player][parse_type + '-performance'], parse_dict[boss][player]['last-weeks-'+parse_type+'-performance']))
             except KeyError:
                 continue
-    return sorted(overall_difference_set, key=lambda x: x[1], reverse=True)[:get_amount]
+    # ties keep boss then player order
+    return heapq.nlargest(get_amount, overall_difference_list, key=lambda x: x[1])
 
 
 def get_best_overall_parse_differential(raidnight_object, raid_folder, get_amount):
@@ -530,12 +718,12 @@ def get_best_ilvl_parse_differential(raidnight_object, raid_folder, get_amount):
     return get_best_parse_differential(raidnight_object, raid_folder, get_amount, 'ilvl')
 
 def get_best_overall_avg_improvement(raidnight_object, raid_folder, get_amount):
-    _, player_averages = differential_parse_dict(raidnight_object, raid_folder)
+    _, player_averages = differential_parse_data(raidnight_object, raid_folder)
 
     return sorted([(k, player_averages[k]['ov_diff']) for k in player_averages], key=lambda x: x[1], reverse=True)[:get_amount]
 
 def get_best_ilvl_avg_improvement(raidnight_object, raid_folder, get_amount):
-    _, player_averages = differential_parse_dict(raidnight_object, raid_folder)
+    _, player_averages = differential_parse_data(raidnight_object, raid_folder)
 
     return sorted([(k, player_averages[k]['ilvl_diff'], player_averages[k]['last_week_ilvl_parse'], player_averages[k]['this_week_ilvl_parse']) \
              for k in player_averages], key=lambda x: x[1], reverse=True)[:get_amount]
@@ -638,6 +826,10 @@ def complete_report(raidnight, raid_folder, report_filename, wcl_string, improve
         raidnight.raidnight_date).strftime("%A %m/%d/%y")
 
     report_title = ' '.join([raidnight.raid_difficulty, raid_name, raid_date])
+    best = get_best_many(raidnight, {'raid-ilvl-parse': 1,
+                                     'ilvl-parse': 10,
+                                     'overall-parse': 5,
+                                     'hps': 5})
     with open(report_filename, 'w') as open_file:
         open_file.write('```\n')
         open_file.write(report_title + '\n')
@@ -659,7 +851,7 @@ def complete_report(raidnight, raid_folder, report_filename, wcl_string, improve
         open_file.write('(' + ', '.join(wipes) + ')')
 
         open_file.write("\n\nTONIGHT'S TOP FIGHT:" + '\n')
-        for rank, (boss, overall, ilvl) in enumerate(get_best_raid_ilvl_parse(raidnight, 1), 1):
+        for rank, (boss, overall, ilvl) in enumerate(best['raid-ilvl-parse'], 1):
             open_file.write(f'{boss}: {round(ilvl, 1)} raid average ilvl parse\n')
 
         if improved:
@@ -680,19 +872,19 @@ def complete_report(raidnight, raid_folder, report_filename, wcl_string, improve
                 # improved overall performance is largely redundant with ilvl performance, so I left it out
 
         open_file.write("\nTOP ILVL DPS PERFORMANCES:" + '\n')
-        for rank, parsedata in enumerate(get_best_ilvl_parse(raidnight, 10), 1):
+        for rank, parsedata in enumerate(best['ilvl-parse'], 1):
             # write format 1.) character -- 15.0k DPS (boss, 4:00)
             open_file.write(str(rank) + ".) " +
                             ilvl_parse_report_string(raidnight, parsedata) + '\n')
 
         open_file.write("\nTOP SPEC-WIDE DPS PERFORMANCES:" + '\n')
-        for rank, parsedata in enumerate(get_best_overall_parse(raidnight, 5), 1):
+        for rank, parsedata in enumerate(best['overall-parse'], 1):
             # write format 1.) character -- 15.0k DPS (boss, 4:00)
             open_file.write(str(rank) + ".) " +
                             overall_parse_report_string(raidnight, parsedata) + '\n')
 
         open_file.write("\nBEST HPS (SINGLE FIGHT):" + '\n')
-        for rank, parsedata in enumerate(get_best_hps(raidnight, 5), 1):
+        for rank, parsedata in enumerate(best['hps'], 1):
             # write format 1.) character -- 15.0k HPS (boss, 4:00)
             open_file.write(str(rank) + ".) " +
                             hps_report_string(raidnight, parsedata) + '\n')
@@ -704,17 +896,43 @@ def complete_report(raidnight, raid_folder, report_filename, wcl_string, improve
     with open(report_filename, 'r') as open_file:
         print(open_file.read())
 
+# raidnights already loaded by this process, {(folder, code): (file mtime, RaidnightData)},
+# least recently used first
+_loaded_raidnights = OrderedDict()
+# enough for complete_report's night and the nights of the lockout before it
+LOADED_RAIDNIGHTS_KEPT = 8
+
+
+def load_raidnight(wcl_string, raid_folder):
+    """
+    Returns a (lazy) RaidnightData for a report, reusing the most recently loaded raidnights
+
+    The same object is handed to every caller until the file changes on disk or the night
+    falls out of the LOADED_RAIDNIGHTS_KEPT most recently used ones.
+    Reports not yet in the raid folder are fetched from wcl and not cached.
+    """
+    entry = get_catalog(raid_folder).get(wcl_string)
+    key = (realpath(raid_folder), wcl_string)
+    cached = _loaded_raidnights.get(key)
+    if cached and entry and cached[0] == entry['mtime']:
+        _loaded_raidnights.move_to_end(key)
+        return cached[1]
+
+    raidnight = RaidnightData(wcl_string, raid_folder, lazy=True)
+    if entry:
+        _loaded_raidnights[key] = (entry['mtime'], raidnight)
+        _loaded_raidnights.move_to_end(key)
+        while len(_loaded_raidnights) > LOADED_RAIDNIGHTS_KEPT:
+            _loaded_raidnights.popitem(last=False)
+    return raidnight
+
 # returns a list of raidnight objects in the folder that have the prior week's lockout period
 
 
 def get_prior_week_data(raidnight, raidfolder):
-    raids_list = []
-    raid_name = raidnight.raid_name
-    for somefile in [f for f in listdir(raidfolder) if isfile(join(raidfolder, f)) and re.search(raid_name, f)]:
-        temp_raidnight = RaidnightData(somefile, raidfolder)
-        if temp_raidnight.get_raid_lockout_period() + 1 == raidnight.get_raid_lockout_period():
-            raids_list.append(temp_raidnight)
-    return raids_list
+    prior_lockout = raidnight.get_raid_lockout_period() - 1
+    return [load_raidnight(code, raidfolder)
+            for code in get_catalog(raidfolder).codes_in_lockout(raidnight.raid_name, prior_lockout)]
 
 if __name__ == '__main__':
     wcl_string = '2cHFAgv6GPyZ1Tfj'
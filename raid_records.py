@@ -0,0 +1,219 @@
+""" Compact in-memory records for the sections of a loaded raid night
+
+Raid files hold every player entry, death, parse and fight as a json object, and a loaded
+night would otherwise keep each of them as a dictionary of its own. RaidnightData converts
+the sections once at load into slotted records instead: FightEntry (a damage-done or healing
+entry), DeathRecord, ParseRecord and Fight. Player names, specs and boss names are interned,
+so every night of a season shares one copy of each string.
+
+Records still answer item lookups by their json key (entry['itemLevel'], parse['ilvl-performance'])
+so code written against the raw dictionaries keeps working; a field that was absent from the
+json raises KeyError as before.
+
+Records only hold the fields the summarizer reads. Running this module over raid files checks
+that those fields come back unchanged from a conversion to records and back.
+
+Usage:
+    python raid_records.py MyDudes/*.json
+"""
+
+import argparse
+import sys
+
+from raid_compression import load_json
+from raid_dedup import expand
+from raid_stream import entry_fields
+
+intern = sys.intern
+
+
+class _Record():
+    """Base of the record classes
+
+    json_fields maps each json key to the attribute holding it; absent fields are held as None.
+    """
+    __slots__ = ()
+    json_fields = dict()
+    # attributes whose strings are interned
+    interned = ()
+
+    @classmethod
+    def from_json(cls, json_dict):
+        record = cls.__new__(cls)
+        for key, attribute in cls.json_fields.items():
+            value = json_dict.get(key)
+            if attribute in cls.interned and value is not None:
+                value = intern(value)
+            setattr(record, attribute, value)
+        return record
+
+    def to_json(self):
+        return {key: getattr(self, attribute) for key, attribute in self.json_fields.items()
+                if getattr(self, attribute) is not None}
+
+    def __getitem__(self, key):
+        try:
+            value = getattr(self, self.json_fields[key])
+        except KeyError:
+            raise KeyError(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, self.json_fields[key], value)
+        except KeyError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def keys(self):
+        return [key for key, attribute in self.json_fields.items() if getattr(self, attribute) is not None]
+
+    def update(self, json_dict):
+        for key, value in json_dict.items():
+            self[key] = value
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_json()})'
+
+
+class FightEntry(_Record):
+    """One player's line of a damage-done or healing table"""
+    __slots__ = ('name', 'type', 'icon', 'item_level', 'total', 'active_time')
+    json_fields = {'name': 'name', 'type': 'type', 'icon': 'icon', 'itemLevel': 'item_level',
+                   'total': 'total', 'activeTime': 'active_time'}
+    interned = ('name', 'type', 'icon')
+
+    def get_dps(self, fight_time):
+        """
+        Returns the entry's total per second (damage or healing) over a fight of fight_time ms, as an int
+        """
+        return int(self.total/fight_time*1000)
+
+    get_hps = get_dps
+
+
+class DeathRecord(_Record):
+    """A player death in a deaths table"""
+    __slots__ = ('name', 'icon', 'timestamp')
+    json_fields = {'name': 'name', 'icon': 'icon', 'timestamp': 'timestamp'}
+    interned = ('name', 'icon')
+
+
+class ParseRecord(_Record):
+    """A player's scraped parse percentiles for one kill, plus the differential fields
+    differential_parse_dict adds to it
+    """
+    __slots__ = ('overall', 'ilvl', 'overall_difference', 'ilvl_difference',
+                 'last_weeks_overall', 'last_weeks_ilvl')
+    json_fields = {'overall-performance': 'overall', 'ilvl-performance': 'ilvl',
+                   'overall-difference': 'overall_difference', 'ilvl-difference': 'ilvl_difference',
+                   'last-weeks-overall-performance': 'last_weeks_overall',
+                   'last-weeks-ilvl-performance': 'last_weeks_ilvl'}
+
+
+class Fight(_Record):
+    """One pull (boss or trash) of the wcl fights list"""
+    __slots__ = ('id', 'start_time', 'end_time', 'boss', 'name', 'difficulty', 'kill', 'size')
+    json_fields = {'id': 'id', 'start_time': 'start_time', 'end_time': 'end_time', 'boss': 'boss',
+                   'name': 'name', 'difficulty': 'difficulty', 'kill': 'kill', 'size': 'size'}
+    interned = ('name',)
+
+
+def _convert_tables(section, record_class):
+    # {fight name: {'entries': [...], ...}} with the entries as records
+    return {intern(fight_name): dict(table, entries=[record_class.from_json(entry) for entry in table['entries']])
+            if 'entries' in table else table
+            for fight_name, table in section.items()}
+
+
+def convert_player_tables(section):
+    """
+    Converts a damage-done or healing section to FightEntry records
+    """
+    return _convert_tables(section, FightEntry)
+
+
+def convert_deaths(section):
+    return _convert_tables(section, DeathRecord)
+
+
+def convert_parse_scrapes(section):
+    return {intern(fight_name): {intern(player_name): ParseRecord.from_json(parse)
+                                 for player_name, parse in players.items()}
+            for fight_name, players in section.items()}
+
+
+def convert_fights(fights_dict):
+    """
+    Converts the wcl fights dictionary, keeping its report fields and the fights as Fight records
+
+    The per-actor lists (friendlies, enemies, pets, phases) are not kept; nothing reads them
+    and they are most of the section.
+    """
+    converted = {key: value for key, value in fights_dict.items() if not isinstance(value, list)}
+    converted['fights'] = [Fight.from_json(fight) for fight in fights_dict['fights']]
+    return converted
+
+
+# raid file section: converter to records
+section_converters = {'fights': convert_fights,
+                      'damage-done': convert_player_tables,
+                      'healing': convert_player_tables,
+                      'deaths': convert_deaths,
+                      'parse-scrapes': convert_parse_scrapes}
+
+
+def convert_section(key, section):
+    """
+    Converts a raid file section to records; sections without records are returned as they are
+    """
+    converter = section_converters.get(key)
+    return converter(section) if converter else section
+
+
+def check_conversion(file_dict):
+    """
+    Returns the (section, fight name, field) of every field the summarizer reads that does not
+    come back unchanged from converting a raid json dictionary's sections to records and back
+    """
+    mismatches = set()
+    for key, fields in entry_fields.items():
+        for fight_name, table in convert_section(key, file_dict.get(key, dict())).items():
+            original_entries = file_dict[key][fight_name].get('entries', [])
+            for entry, record in zip(original_entries, table.get('entries', [])):
+                record_json = record.to_json()
+                mismatches.update((key, fight_name, field) for field in fields
+                                  if entry.get(field) != record_json.get(field))
+    for fight_name, players in convert_parse_scrapes(file_dict.get('parse-scrapes', dict())).items():
+        for player_name, parse in players.items():
+            original = file_dict['parse-scrapes'][fight_name][player_name]
+            parse_json = parse.to_json()
+            mismatches.update(('parse-scrapes', fight_name, field) for field in original
+                              if original[field] != parse_json.get(field))
+    return sorted(mismatches)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that raid json files convert to records without losing read fields')
+    parser.add_argument('filepaths', type=str, nargs='+',
+                        help="the raid json files to check")
+    args = parser.parse_args()
+
+    failed = 0
+    for filepath in args.filepaths:
+        mismatches = check_conversion(expand(load_json(filepath)))
+        if mismatches:
+            failed += 1
+            print(f'{filepath}: {len(mismatches)} fields changed, e.g. {mismatches[0]}')
+    print(f'{failed} of {len(args.filepaths)} files changed by the conversion')
+    sys.exit(1 if failed else 0)
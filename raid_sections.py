@@ -0,0 +1,163 @@
+""" Section-on-demand reading of raid json files
+
+Raid files are written with json.dump(..., indent=4), so every top-level key sits on its
+own line with exactly four spaces of indentation. index_sections records the byte range of
+each top-level value, which lets a single section (e.g. 'fights') be parsed without
+reading the megabytes of damage-done and healing tables around it.
+
+Raid nights stored in the columnar format (see raid_columnar) are read through the same
+read(key) interface, so callers do not need to know which format a file is in. Compressed
+json files (see raid_compression) have no offsets and are loaded whole on the first read.
+The gear and talents of deduplicated files (see raid_dedup) are expanded as they are read.
+"""
+
+import json
+
+from raid_columnar import COLUMNAR_EXTENSION, ColumnarReader
+from raid_compression import detect_compression, open_raid_file
+from raid_dedup import BLOBS_SECTION, deduplicated_sections, expand, expand_section
+from raid_stream import decode_projected_section, load_projected
+
+_decoder = json.JSONDecoder()
+
+
+def index_sections(filepath):
+    """
+    Finds the byte range of every top-level value in an indent=4 raid json file
+
+    Parameters:
+    filepath (str): path to the raid json file
+
+    Returns:
+    (dict): {section key: [start offset, end offset]}, empty if the layout is not recognized
+        or the file is compressed
+    """
+    if detect_compression(filepath) is not None:
+        return dict()
+    offsets = dict()
+    previous_key = None
+    position = 0
+    with open(filepath, 'rb') as open_file:
+        first_line = open_file.readline()
+        if first_line.strip() != b'{':
+            return dict()
+        position += len(first_line)
+        for line in open_file:
+            if line.startswith(b'    "'):
+                key_end = line.find(b'": ', 5)
+                if key_end == -1:
+                    return dict()
+                key = json.loads(line[4:key_end+1].decode('utf-8'))
+                if previous_key is not None:
+                    offsets[previous_key][1] = position
+                offsets[key] = [position + key_end + 3, None]
+                previous_key = key
+            position += len(line)
+    if previous_key is not None:
+        offsets[previous_key][1] = position
+    return offsets
+
+
+def read_section(filepath, offsets, key, project=False):
+    """
+    Parses a single top-level value from a raid json file using offsets from index_sections
+
+    With project set, player entries only keep the fields the summarizer uses (see raid_stream).
+    """
+    start, end = offsets[key]
+    with open(filepath, 'rb') as open_file:
+        open_file.seek(start)
+        text = open_file.read(end - start).decode('utf-8')
+    if project:
+        return decode_projected_section(key, text)
+    value, _ = _decoder.raw_decode(text)
+    return value
+
+
+class SectionReader():
+    """Reads the top-level sections of one raid json file on demand
+    Attributes:
+        filepath: path to the raid json file
+        offsets: the byte ranges from index_sections; when empty, the whole
+                file is loaded once on the first read instead
+        project: whether player entries are cut down to the fields the summarizer uses
+        """
+
+    def __init__(self, filepath, offsets=None, project=False):
+        self.filepath = filepath
+        self.offsets = offsets if offsets is not None else index_sections(filepath)
+        self.project = project
+        self._file_dict = None
+        self._blobs = None
+
+    def read(self, key):
+        if key in self.offsets:
+            section = read_section(self.filepath, self.offsets, key, self.project)
+            # projected entries keep none of the shared fields
+            if key in deduplicated_sections and BLOBS_SECTION in self.offsets and not self.project:
+                if self._blobs is None:
+                    self._blobs = read_section(self.filepath, self.offsets, BLOBS_SECTION)
+                section = expand_section(section, self._blobs)
+            return section
+        if self._file_dict is None:
+            self._file_dict = load_raid_file(self.filepath, self.project)
+        return self._file_dict[key]
+
+
+class LazySection():
+    """A class attribute that reads one file section the first time it is accessed on an instance
+
+    The instance must provide a _section_reader (SectionReader). The value, passed through
+    convert if one is given, is stored in the instance __dict__, so later reads and assignments
+    never go through the descriptor again.
+    """
+
+    def __init__(self, file_key, convert=None):
+        self.file_key = file_key
+        self.convert = convert
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            section_reader = instance.__dict__['_section_reader']
+        except KeyError:
+            raise AttributeError(self.name)
+        value = section_reader.read(self.file_key)
+        if self.convert is not None:
+            value = self.convert(value)
+        instance.__dict__[self.name] = value
+        return value
+
+
+def open_section_reader(filepath, offsets=None, project=False):
+    """
+    Returns a reader with a read(key) method for a raid file in either storage format
+
+    Columnar files only hold the projected fields, so project only affects json files.
+    """
+    if filepath.endswith(COLUMNAR_EXTENSION):
+        return ColumnarReader(filepath)
+    return SectionReader(filepath, offsets, project)
+
+
+def load_raid_file(filepath, project=False):
+    """
+    Loads every section of a raid file in either storage format
+
+    Parameters:
+    project (bool): stream the file, keeping only the player entry fields the summarizer uses
+
+    Returns:
+    (dict): the raid json dictionary
+    """
+    if filepath.endswith(COLUMNAR_EXTENSION):
+        return ColumnarReader(filepath).read_all()
+    if project:
+        return load_projected(filepath)
+    with open_raid_file(filepath, 'rb') as open_file:
+        return expand(json.loads(open_file.read()))
@@ -0,0 +1,168 @@
+""" Projected reading of raid json files
+
+A raid json file keeps the full wcl tables, but the summarizer only uses a few fields of
+each player entry (see raid_columnar.player_columns); abilities, gear, talents, targets and
+pets make up most of the file. The readers here drop those fields while the file is being
+decoded, so the full nested dictionary is never built.
+
+With ijson (see requirements.txt), whole files are parsed as an event stream and unused
+fields are skipped as they go by, so memory stays bounded by the projected night; this is
+the only path with that guarantee. Without it, and for single sections, objects are decoded
+one member (e.g. one boss table) at a time with the standard library decoder and projected
+before the next member is read, but the whole text of the file or section is held while
+decoding.
+"""
+
+import json
+import re
+
+from raid_columnar import player_columns
+from raid_compression import open_raid_file
+from raid_dedup import BLOBS_SECTION
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# fields kept from the entries of each per-fight section; other sections are read in full
+entry_fields = {'damage-done': frozenset(player_columns),
+                'healing': frozenset(player_columns),
+                'deaths': frozenset(['name', 'icon', 'timestamp'])}
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+def project_table(table, fields):
+    """
+    Returns a copy of a wcl table ({'entries': [...], 'totalTime': ...}) whose entries only hold fields
+    """
+    projected = {key: value for key, value in table.items() if key != 'entries'}
+    projected['entries'] = [{field: value for field, value in entry.items() if field in fields}
+                            for entry in table.get('entries', [])]
+    return projected
+
+
+def _skip_whitespace(text, idx):
+    return _whitespace.match(text, idx).end()
+
+
+def _decode_members(text, idx, decode_value):
+    # decodes the json object starting at text[idx] one member at a time
+    # decode_value(key, text, idx) returns (value, end index) for each member
+    members = dict()
+    idx = _skip_whitespace(text, idx)
+    if text[idx] != '{':
+        raise ValueError(f'expected an object at {idx}')
+    idx = _skip_whitespace(text, idx + 1)
+    if text[idx] == '}':
+        return members, idx + 1
+    while True:
+        key, idx = _decoder.raw_decode(text, idx)
+        idx = _skip_whitespace(text, idx)
+        if text[idx] != ':':
+            raise ValueError(f"expected ':' at {idx}")
+        idx = _skip_whitespace(text, idx + 1)
+        members[key], idx = decode_value(key, text, idx)
+        idx = _skip_whitespace(text, idx)
+        if text[idx] == '}':
+            return members, idx + 1
+        if text[idx] != ',':
+            raise ValueError(f"expected ',' or '}}' at {idx}")
+        idx = _skip_whitespace(text, idx + 1)
+
+
+def _decode_section(key, text, idx):
+    if key not in entry_fields:
+        return _decoder.raw_decode(text, idx)
+    fields = entry_fields[key]
+
+    def decode_table(fight_name, text, idx):
+        table, end = _decoder.raw_decode(text, idx)
+        return project_table(table, fields), end
+
+    return _decode_members(text, idx, decode_table)
+
+
+def decode_projected_section(key, text):
+    """
+    Decodes the text of one top-level section, projecting one fight table at a time
+    """
+    return _decode_section(key, text, _skip_whitespace(text, 0))[0]
+
+
+def _dropped(path):
+    # path: keys from the top level down; None marks an array item
+    # the gear and talents of deduplicated files (see raid_dedup) are only referenced by dropped fields
+    if path == [BLOBS_SECTION]:
+        return True
+    return (len(path) == 5 and path[0] in entry_fields and path[2] == 'entries'
+            and path[3] is None and path[4] not in entry_fields[path[0]])
+
+
+def _build_from_events(events):
+    # builds the projected raid dictionary from ijson basic_parse events
+    root = None
+    containers = []
+    path = []
+    key = None
+    drop_next = False
+    skip_depth = 0
+
+    def add(value):
+        nonlocal root
+        if not containers:
+            root = value
+        elif isinstance(containers[-1], dict):
+            containers[-1][key] = value
+        else:
+            containers[-1].append(value)
+
+    for event, value in events:
+        if skip_depth:
+            if event in ('start_map', 'start_array'):
+                skip_depth += 1
+            elif event in ('end_map', 'end_array'):
+                skip_depth -= 1
+            continue
+        if event == 'map_key':
+            key = value
+            drop_next = _dropped(path + [key])
+            continue
+        if drop_next:
+            drop_next = False
+            if event in ('start_map', 'start_array'):
+                skip_depth = 1
+            continue
+        if event in ('start_map', 'start_array'):
+            container = dict() if event == 'start_map' else []
+            if containers:
+                path.append(key if isinstance(containers[-1], dict) else None)
+            add(container)
+            containers.append(container)
+        elif event in ('end_map', 'end_array'):
+            containers.pop()
+            if containers:
+                path.pop()
+        else:
+            add(value)
+    return root
+
+
+def load_projected(filepath):
+    """
+    Loads a whole raid json file, keeping only the entry fields the summarizer uses
+
+    Returns:
+    (dict): the raid json dictionary with projected damage-done, healing and deaths entries
+    """
+    if ijson is not None:
+        with open_raid_file(filepath, 'rb') as open_file:
+            return _build_from_events(ijson.basic_parse(open_file, use_float=True))
+    # fallback without ijson: holds the file's full text while decoding
+    with open_raid_file(filepath, 'r') as open_file:
+        text = open_file.read()
+    file_dict = _decode_members(text, 0, _decode_section)[0]
+    file_dict.pop(BLOBS_SECTION, None)
+    return file_dict
@@ -0,0 +1,53 @@
+""" Per-fight checkpoints for reports being downloaded from wcl
+
+Each fight's deaths, damage-done, healing and parse-scrapes results are written to
+<raid_folder>/.checkpoints/<wcl code>/ as soon as they arrive, so an ingestion that fails
+partway can be rerun without refetching what it already has, and a report that is still
+being logged can be refreshed by fetching only its new fights.
+
+Checkpoints are kept after the report's raid file is written, since a refresh
+(RaidnightData(..., refresh=True)) relies on them, and are never removed automatically.
+They cost about as much disk as the raid file; once a report is final, its folder under
+.checkpoints can be deleted by hand.
+"""
+
+import json
+from os import makedirs
+from os.path import isdir, isfile, join
+
+from raid_compression import atomic_write
+
+CHECKPOINT_FOLDER = '.checkpoints'
+
+
+class ReportCheckpoint():
+    """The saved per-fight results of one report
+    Attributes:
+        folder: the directory holding this report's checkpoint files
+        """
+
+    def __init__(self, raid_folder, wcl_string):
+        self.folder = join(raid_folder, CHECKPOINT_FOLDER, wcl_string)
+        if not isdir(self.folder):
+            makedirs(self.folder)
+
+    def _path(self, fight_id, table_name):
+        return join(self.folder, f'{fight_id}-{table_name}.json')
+
+    def has(self, fight_id, table_name):
+        return isfile(self._path(fight_id, table_name))
+
+    def load(self, fight_id, table_name):
+        with open(self._path(fight_id, table_name), 'r') as open_file:
+            return json.load(open_file)
+
+    def save(self, fight_id, table_name, data):
+        atomic_write(self._path(fight_id, table_name), lambda open_file: json.dump(data, open_file))
+
+    def load_all(self, fight_ids, table_name):
+        """
+        Returns:
+        (dict): {fight_id: data} for every given fight that has a checkpoint for table_name
+        """
+        return {fight_id: self.load(fight_id, table_name)
+                for fight_id in fight_ids if self.has(fight_id, table_name)}
@@ -1,59 +1,207 @@
 from selenium import webdriver
-from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
 import re
 from selenium.webdriver.firefox.options import Options
-from selenium.common.exceptions import TimeoutException
-import pprint
-
-def scrape_damage_parse_data(wcl_string,fight_id):
-    ignore_specs = {'Monk-Mistweaver',
-                    'Paladin-Holy',
-                    'Druid-Restoration',
-                    'Priest-Discipline',
-                    'Priest-Holy',
-                    'Shaman-Restoration'}
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 
+def new_driver():
     options = Options()
     options.add_argument('--headless')
     options.set_preference("dom.max_script_run_time", 5)
     options.set_preference("http.response.timeout", 5)
     driver = webdriver.Firefox(firefox_options=options)
     driver.set_page_load_timeout(10)
+    return driver
 
-    try:
-        driver.get('https://www.warcraftlogs.com/reports/'+wcl_string+'#fight='+str(fight_id)+'&type=damage-done')
-    except:
-        pass
+ignore_specs = {'Monk-Mistweaver',
+                'Paladin-Holy',
+                'Druid-Restoration',
+                'Priest-Discipline',
+                'Priest-Holy',
+                'Shaman-Restoration'}
 
-    all_tablerows_selector = '//div[@id="table-container"]/div/table/tbody/tr'
-    trs = driver.find_elements_by_xpath(all_tablerows_selector)
-    tablerows = len(trs)
-    print(tablerows)
+def _class_xpath(class_name):
+    # first descendant carrying class_name among its classes
+    return etree.XPath("(.//*[contains(concat(' ', normalize-space(@class), ' '), ' " + class_name + " ')])[1]")
 
-    html = driver.page_source
-    driver.quit()
+# compiled once; evaluated per table row
+_tablerows_xpath = etree.XPath("//*[contains(@id, 'main-table-row')]")
+_performance_xpath = _class_xpath('main-table-performance')
+_link_xpath = _class_xpath('main-table-link')
+_ilvl_performance_xpath = _class_xpath('main-table-ilvl-performance')
+_first_link_xpath = etree.XPath("(.//a)[1]")
+_first_img_src_xpath = etree.XPath("(.//img)[1]/@src")
+_spec_icon_regex = re.compile(r'icons/.*\.')
+
+def _first_link_text(element):
+    links = _first_link_xpath(element)
+    if not links:
+        return None
+    return links[0].text_content().strip()
+
+def parse_damage_parse_html(html):
+    '''
+    Extracts the overall and ilvl parse of every dps player from a wcl damage-done page
+
+    Works on any page source, live or saved, without a browser.
 
-    soup = BeautifulSoup(html, "lxml")
+    Parameters:
+        html (str or bytes): the page source
+
+    Returns:
+        dict: {player name: {'overall-performance': int, 'ilvl-performance': int}}
+    '''
+    document = lxml_html.fromstring(html)
 
     single_fight_parse_scrape_data = dict()
-    for tablerow in soup.find_all(id=re.compile('main-table-row')):
-        if not tablerow.find(class_='main-table-performance') or not tablerow.find(class_='main-table-link') or not tablerow.find(class_='main-table-ilvl-performance'):
+    for tablerow in _tablerows_xpath(document):
+        performance = _performance_xpath(tablerow)
+        link = _link_xpath(tablerow)
+        ilvl_performance_cell = _ilvl_performance_xpath(tablerow)
+        if not performance or not link or not ilvl_performance_cell:
             continue
-        if tablerow.find(class_='main-table-link').a.string.strip() == "Hati":
+        player_name = _first_link_text(link[0])
+        if player_name is None or player_name == "Hati":
             continue
-        if tablerow.img['src']:
-            if re.search(r'icons/.*\.', tablerow.img['src']).group()[6:-1] in ignore_specs:
+        img_src = _first_img_src_xpath(tablerow)
+        if img_src and img_src[0]:
+            spec_icon = _spec_icon_regex.search(img_src[0])
+            if spec_icon and spec_icon.group()[6:-1] in ignore_specs:
                 continue
         try:
-            overall_performance = int(tablerow.find(class_='main-table-performance').a.text.strip())
-        except:
+            overall_performance = int(_first_link_text(performance[0]))
+        except (TypeError, ValueError):
             overall_performance = 0
-        player_name = tablerow.find(class_='main-table-link').a.string.strip()
         try:
-            ilvl_performance = int(tablerow.find(class_='main-table-ilvl-performance').a.text.strip())
-        except:
+            ilvl_performance = int(_first_link_text(ilvl_performance_cell[0]))
+        except (TypeError, ValueError):
             ilvl_performance = 0
         single_fight_parse_scrape_data[player_name] = ({'overall-performance': overall_performance,
                                                         'ilvl-performance': ilvl_performance})
 
-    return single_fight_parse_scrape_data
\ No newline at end of file
+    return single_fight_parse_scrape_data
+
+def parse_saved_pages(filepaths):
+    '''
+    Re-parses archived wcl damage-done pages in bulk
+
+    Returns:
+        dict: {filepath: parse scrape dict}
+    '''
+    parsed_pages = dict()
+    for filepath in filepaths:
+        with open(filepath, 'rb') as open_file:
+            parsed_pages[filepath] = parse_damage_parse_html(open_file.read())
+    return parsed_pages
+
+def scrape_damage_parse_data(wcl_string,fight_id,driver=None):
+    '''
+    Scrapes the overall and ilvl parse of every dps player in one fight from the wcl report page
+
+    Parameters:
+        wcl_string (str): the report code
+        fight_id (int): the wcl fight id
+        driver (webdriver): an already running browser to use (e.g. from a BrowserPool);
+            when omitted a new browser is started and quit for this fight
+    '''
+    own_driver = driver is None
+    if own_driver:
+        driver = new_driver()
+    else:
+        # the report page routes on the url fragment, so force a full load of the new fight
+        driver.get('about:blank')
+
+    try:
+        driver.get('https://www.warcraftlogs.com/reports/'+wcl_string+'#fight='+str(fight_id)+'&type=damage-done')
+    except:
+        pass
+
+    html = driver.page_source
+    if own_driver:
+        driver.quit()
+
+    return parse_damage_parse_html(html)
+
+class BrowserPool():
+    '''
+    A set of long-lived headless browsers shared across parse scrapes
+
+    Usage:
+        with BrowserPool(2) as pool:
+            parse_scrapes = pool.scrape_many(wcl_string, [3, 7, 12])
+
+    Browsers are started on first use, so a pool that never scrapes never launches Firefox.
+    '''
+
+    def __init__(self, size=1):
+        self.size = size
+        self._drivers = []
+        self._idle = queue.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for driver in self._drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        self._drivers = []
+        self._idle = queue.Queue()
+
+    @contextmanager
+    def driver(self):
+        '''
+        Lends out an idle browser, starting a new one while the pool is below its size
+        '''
+        try:
+            driver = self._idle.get_nowait()
+        except queue.Empty:
+            if len(self._drivers) < self.size:
+                driver = new_driver()
+                self._drivers.append(driver)
+            else:
+                driver = self._idle.get()
+        try:
+            yield driver
+        finally:
+            self._idle.put(driver)
+
+    def scrape(self, wcl_string, fight_id):
+        with self.driver() as driver:
+            return scrape_damage_parse_data(wcl_string, fight_id, driver)
+
+    def scrape_many(self, wcl_string, fight_ids, on_result=None):
+        '''
+        Scrapes several fights of a report, spread across the pool's browsers
+
+        Parameters:
+            on_result (function): called as on_result(fight_id, parse scrape dict) as each fight finishes
+
+        Returns:
+            dict: {fight_id: parse scrape dict}
+            (if any fight fails, the first error is raised once the others have finished)
+        '''
+        results = dict()
+        first_error = None
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            futures = {executor.submit(self.scrape, wcl_string, fight_id): fight_id for fight_id in fight_ids}
+            for future in as_completed(futures):
+                fight_id = futures[future]
+                try:
+                    results[fight_id] = future.result()
+                except Exception as error:
+                    if first_error is None:
+                        first_error = error
+                    continue
+                if on_result:
+                    on_result(fight_id, results[fight_id])
+        if first_error is not None:
+            raise first_error
+        return {fight_id: results[fight_id] for fight_id in fight_ids}
@@ -0,0 +1,167 @@
+""" A season-wide table of every player's parses and dps, kept next to the raid files
+
+Season analytics (raid_cull) used to construct every RaidnightData in a folder and fill a
+wide DataFrame one cell at a time. The aggregate instead ingests each night once into a
+long-format table with one row per (night, boss, player), stores it in the raid folder,
+and on later runs only ingests nights that are new or whose file changed. Wide views such
+as the (player, lockout) x boss ilvl parse matrix are built from it with a single pivot.
+"""
+
+from math import isnan
+from os.path import realpath
+
+import pandas as pd
+
+from raid_catalog import NightStore, get_catalog
+from raid_night_summarizer import load_raidnight
+
+AGGREGATE_FILENAME = '.season-aggregate.json'
+AGGREGATE_VERSION = 3
+
+# columns of each night's stored rows, taken from RaidnightData.player_frame
+night_row_columns = ['boss', 'fight_time', 'player', 'spec', 'damage', 'dps', 'overall_parse', 'ilvl_parse']
+# night fields copied onto every row of the long table, from the catalog entry
+night_columns = ['code', 'raid_name', 'difficulty', 'date', 'lockout']
+parse_table_columns = night_columns + night_row_columns
+
+
+def _json_value(value):
+    # json has no NaN; missing numbers are stored as null
+    if isinstance(value, float) and isnan(value):
+        return None
+    return value
+
+
+def night_rows(raidnight):
+    """
+    Returns the long-format rows of one raidnight: [boss, fight_time, player, spec, damage, dps, overall_parse, ilvl_parse]
+
+    Parameters:
+    raidnight (RaidnightData)
+    """
+    frame = raidnight.player_frame()
+    frame_columns = ['fight', 'fight_time', 'player', 'spec', 'damage', 'dps', 'overall_parse', 'ilvl_parse']
+    return [[_json_value(value) for value in row]
+            for row in frame[frame_columns].itertuples(index=False, name=None)]
+
+
+def rows_to_table(nights):
+    """
+    Builds the long parse table from stored nights
+
+    Parameters:
+    nights (list): (night fields dict, rows) pairs, in the order the table should keep
+
+    Returns:
+    (pandas.DataFrame): one row per (night, boss, player), with parse_table_columns
+    """
+    records = [[night['code'], night['raid-name'], night['difficulty'], night['date'], night['lockout']] + row
+               for night, rows in nights for row in rows]
+    table = pd.DataFrame(records, columns=parse_table_columns)
+    for column in ['fight_time', 'damage', 'dps', 'overall_parse', 'ilvl_parse']:
+        table[column] = table[column].astype(float)
+    return table
+
+
+def raidnights_table(raidnights):
+    """
+    Builds the long parse table for RaidnightData objects that are not (or not yet) in an aggregate
+    """
+    if not isinstance(raidnights, list):
+        raidnights = [raidnights]
+    nights = [({'code': raidnight.wcl_string,
+                'raid-name': raidnight.raid_name,
+                'difficulty': raidnight.raid_difficulty,
+                'date': raidnight.raidnight_date,
+                'lockout': raidnight.get_raid_lockout_period()}, night_rows(raidnight))
+              for raidnight in raidnights]
+    return rows_to_table(nights)
+
+
+def ilvl_parse_matrix(table, value='ilvl_parse'):
+    """
+    Pivots a long parse table into the wide matrix used by raid_cull
+
+    Nights without a known lockout are left out. When a player has several parses on a boss
+    in one lockout, the last night's parse is kept.
+
+    Returns:
+    (pandas.DataFrame): rows indexed by (Player, Lockout), one column per boss in order of first kill
+    """
+    table = table[table[value].notna() & table['lockout'].notna()]
+    matrix = table.pivot_table(index=['player', 'lockout'], columns='boss', values=value, aggfunc='last')
+    matrix = matrix.reindex(columns=pd.unique(table['boss']))
+    matrix.index = matrix.index.set_levels(matrix.index.levels[1].astype(int), level=1)
+    matrix.index.names = ['Player', 'Lockout']
+    matrix.columns.name = None
+    return matrix
+
+
+class SeasonAggregate(NightStore):
+    """The long-format parse table of every raid file in a raid folder
+    Attributes:
+        raid_folder: the folder being aggregated
+        nights: dictionary of form {wcl_code: night}, where each night holds the file's mtime and size,
+                raid-name, difficulty, date, lockout and rows (see night_row_columns)
+        """
+    filename = AGGREGATE_FILENAME
+    version = AGGREGATE_VERSION
+
+    def __init__(self, raid_folder):
+        super().__init__(raid_folder)
+        self._table = None
+        self.refresh()
+
+    def refresh(self):
+        changed = super().refresh()
+        if changed:
+            self._table = None
+        return changed
+
+    def read_night(self, code, entry):
+        raidnight = load_raidnight(code, self.raid_folder)
+        return {'raid-name': entry['raid-name'],
+                'difficulty': entry['difficulty'],
+                'date': entry['date'],
+                'lockout': entry['lockout'],
+                'rows': night_rows(raidnight)}
+
+    def update_night(self, night, entry):
+        if night['lockout'] == entry['lockout']:
+            return False
+        # the catalog recomputed it, e.g. after a release date was added
+        night['lockout'] = entry['lockout']
+        return True
+
+    def parse_table(self, codes=None):
+        """
+        Returns the long parse table, in catalog (chronological) order
+
+        Parameters:
+        codes (list): only include these nights, e.g. get_catalog(folder).query(difficulty='Heroic')
+        """
+        if self._table is None:
+            ordered_codes = [code for code in get_catalog(self.raid_folder).codes() if code in self.nights]
+            self._table = rows_to_table([(dict(self.nights[code], code=code), self.nights[code]['rows'])
+                                         for code in ordered_codes])
+        if codes is None:
+            return self._table
+        return self._table[self._table['code'].isin(codes)]
+
+    def ilvl_parse_matrix(self, codes=None):
+        return ilvl_parse_matrix(self.parse_table(codes))
+
+
+_aggregates = dict()
+
+
+def get_season_aggregate(raid_folder):
+    """
+    Returns the process-wide SeasonAggregate for a raid folder, brought up to date with the folder
+    """
+    key = realpath(raid_folder)
+    if key not in _aggregates:
+        _aggregates[key] = SeasonAggregate(raid_folder)
+    else:
+        _aggregates[key].refresh()
+    return _aggregates[key]
@@ -0,0 +1,208 @@
+""" Persistent cache of wcl api responses
+
+Every fights and table response is kept in <raid_folder>/.wcl-cache/, keyed by its path and
+query with the api_key removed (see wcl_replay.request_key), so ingesting a report again, e.g.
+after the raid file format changes, does not download it again, whichever host, port or scheme
+the request went through. Entries keyed by the full url before this are never matched again
+and are evicted like any unused response.
+
+The report a response belongs to decides how it is reused. Once a report ended more than
+immutable_after seconds ago it can no longer change, and its responses are served without
+touching the network. Responses of recent reports (or of reports whose end is not known yet)
+are revalidated on every use, with If-None-Match/If-Modified-Since when wcl sent an ETag or
+Last-Modified, so an unchanged response costs a 304 instead of a download.
+
+The cache is bounded by max_bytes; the least recently used responses are evicted first.
+The index of saved responses is written by flush(), which get_wcl_api.flush_response_cache
+calls once a batch of requests is done, and which also runs at exit.
+"""
+
+import atexit
+import hashlib
+import json
+import threading
+import time
+from os import makedirs, remove
+from os.path import getsize, isdir, isfile, join
+from urllib.parse import urlsplit
+
+from raid_compression import atomic_write
+from wcl_replay import RecordedResponse, request_key
+
+CACHE_FOLDER = '.wcl-cache'
+INDEX_FILENAME = 'index.json'
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 1024**3
+# wcl reports stop changing once logging ends; a week leaves room for late uploads
+DEFAULT_IMMUTABLE_AFTER = 7 * 24 * 60 * 60
+NOT_MODIFIED = 304
+
+
+def report_code(url):
+    """
+    Returns the report code of a wcl report api url (its last path segment)
+    """
+    return urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1]
+
+
+class ResponseCache():
+    """wcl api responses saved on disk
+    Attributes:
+        folder: where the responses and their index are kept
+        max_bytes: the total size of saved responses beyond which the least recently used are evicted
+        immutable_after: seconds after a report's end from which its responses are never revalidated
+        hits, revalidated, fetched: the number of responses served from disk without a request,
+            confirmed with a 304, and downloaded
+        """
+
+    def __init__(self, folder, max_bytes=DEFAULT_MAX_BYTES, immutable_after=DEFAULT_IMMUTABLE_AFTER):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.immutable_after = immutable_after
+        self.hits = 0
+        self.revalidated = 0
+        self.fetched = 0
+        if not isdir(folder):
+            makedirs(folder)
+
+        # {key: {'url', 'size', 'used', 'etag', 'last-modified'}}
+        self.entries = dict()
+        # {report code: report end (unix seconds)}, learned from fights responses
+        self.report_ends = dict()
+        self._lock = threading.Lock()
+        # serializes index writes, which happen outside _lock
+        self._flush_lock = threading.Lock()
+        self._dirty = False
+        self._load_index()
+        # max_bytes may be smaller than when the responses were saved
+        with self._lock:
+            self._evict()
+        atexit.register(self.flush)
+
+    def _index_path(self):
+        return join(self.folder, INDEX_FILENAME)
+
+    def _path(self, key):
+        return join(self.folder, key + '.json')
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), 'r') as open_file:
+                index = json.load(open_file)
+            if index.get('version') == CACHE_VERSION:
+                self.entries = index['entries']
+                self.report_ends = index['report-ends']
+        except (IOError, ValueError):
+            pass
+        # responses whose file went missing are forgotten
+        self.entries = {key: entry for key, entry in self.entries.items() if isfile(self._path(key))}
+
+    def flush(self):
+        """
+        Writes the index if it changed
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                index_text = json.dumps({'version': CACHE_VERSION, 'entries': self.entries,
+                                         'report-ends': self.report_ends})
+                self._dirty = False
+            atomic_write(self._index_path(), lambda open_file: open_file.write(index_text))
+
+    def size(self):
+        return sum(entry['size'] for entry in self.entries.values())
+
+    def is_immutable(self, url):
+        report_end = self.report_ends.get(report_code(url))
+        return report_end is not None and time.time() - report_end > self.immutable_after
+
+    def _load(self, key, url):
+        with open(self._path(key), 'r') as open_file:
+            text = open_file.read()
+        return RecordedResponse(url, 200, text)
+
+    def _store(self, key, request, response):
+        text = response.text
+        if not isdir(self.folder):
+            makedirs(self.folder)
+        atomic_write(self._path(key), lambda open_file: open_file.write(text))
+
+        with self._lock:
+            self.fetched += 1
+            self.entries[key] = {'url': request,
+                                 'size': getsize(self._path(key)),
+                                 'used': time.time(),
+                                 'etag': response.headers.get('ETag'),
+                                 'last-modified': response.headers.get('Last-Modified')}
+            if urlsplit(request).path.rstrip('/').split('/')[-2] == 'fights':
+                try:
+                    self.report_ends[report_code(request)] = json.loads(text)['end']//1000
+                except (ValueError, KeyError, TypeError):
+                    pass
+            self._dirty = True
+            self._evict()
+
+    def _evict(self):
+        # called with the lock held
+        total = self.size()
+        for key in sorted(self.entries, key=lambda key: self.entries[key]['used']):
+            if total <= self.max_bytes:
+                break
+            total -= self.entries[key]['size']
+            del self.entries[key]
+            self._dirty = True
+            try:
+                remove(self._path(key))
+            except OSError:
+                pass
+
+    def _touch(self, key, counter):
+        # counter: the statistic to count the use under, 'hits' or 'revalidated'
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            if key in self.entries:
+                self.entries[key]['used'] = time.time()
+                self._dirty = True
+
+    def get(self, url, fetch):
+        """
+        Returns the response for url from the cache, revalidated or downloaded with fetch as needed
+
+        Parameters:
+            url (str): the request url, api_key included
+            fetch (function): fetch(url, headers) makes the request, returning a requests.Response
+
+        Error responses are returned as they are and never saved.
+        """
+        request = request_key(url)
+        key = hashlib.sha1(request.encode('utf-8')).hexdigest()
+        entry = self.entries.get(key)
+
+        if entry and self.is_immutable(url):
+            try:
+                response = self._load(key, url)
+            except OSError:
+                # evicted by another process sharing the folder
+                entry = None
+            else:
+                self._touch(key, 'hits')
+                return response
+
+        headers = dict()
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last-modified'):
+            headers['If-Modified-Since'] = entry['last-modified']
+        response = fetch(url, headers)
+        if entry and response.status_code == NOT_MODIFIED:
+            try:
+                cached = self._load(key, url)
+            except OSError:
+                response = fetch(url, dict())
+            else:
+                self._touch(key, 'revalidated')
+                return cached
+        if response.status_code == 200:
+            self._store(key, request, response)
+        return response
@@ -0,0 +1,137 @@
+""" Concurrent fetching of the wcl tables for every fight in a report """
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import get_wcl_api
+
+# wcl v1 keys are limited per minute; stay comfortably below that by default
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_REQUESTS_PER_SECOND = 4.0
+
+
+class RateLimiter():
+    """Spaces calls evenly so no more than requests_per_second start in any second
+
+    Thread-safe; wait() blocks the calling thread until its slot comes up.
+    A requests_per_second of None or 0 disables limiting.
+    """
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0/requests_per_second if requests_per_second else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def report_table_requests(wcl_string, fights, api_key):
+    """
+    Lists the table requests RaidnightData needs for a report
+
+    deaths are requested for every boss pull, damage-done and healing for kills only
+
+    Parameters:
+    wcl_string (str): the report code
+    fights (list): the 'fights' list of the wcl fights dictionary
+    api_key (str): the wcl api key
+
+    Returns:
+    (list): (fight id, table name, fightstring) tuples, in fight order
+    """
+    table_requests = []
+    for fight in fights:
+        if not fight['boss']:
+            continue
+        fight_api_call_string = ''.join(["/", wcl_string, "?start=", str(
+            fight['start_time']), "&end=", str(fight['end_time']), "&api_key=", api_key])
+        table_names = ['deaths', 'damage-done', 'healing'] if fight['kill'] else ['deaths']
+        for table_name in table_names:
+            table_requests.append((fight['id'], table_name, table_name + fight_api_call_string))
+    return table_requests
+
+
+def fetch_tables(fightstrings, max_workers=DEFAULT_MAX_WORKERS,
+                 requests_per_second=DEFAULT_REQUESTS_PER_SECOND, on_result=None):
+    """
+    Calls get_wcl_api_table for each fightstring on a bounded thread pool
+
+    Parameters:
+    fightstrings (list): strings as passed to get_wcl_api_table, e.g. 'deaths/<code>?start=...'
+    max_workers (int): the most requests in flight at once
+    requests_per_second (float): the most requests started per second (None for no limit)
+    on_result (function): called as on_result(index, result) as each response arrives
+
+    Returns:
+    (list): the decoded json responses, in the same order as fightstrings
+            (if any request fails, the first error is raised once the others have finished)
+    """
+    rate_limiter = RateLimiter(requests_per_second)
+    # size the shared connection pool so every worker can keep its connection alive
+    get_wcl_api.get_session(max_workers)
+
+    def fetch(fightstring):
+        rate_limiter.wait()
+        return get_wcl_api.get_wcl_api_table(fightstring)
+
+    results = [None]*len(fightstrings)
+    first_error = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch, fightstring): index
+                   for index, fightstring in enumerate(fightstrings)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as error:
+                if first_error is None:
+                    first_error = error
+                continue
+            if on_result:
+                on_result(index, results[index])
+    # index the responses cached during the batch in one write
+    get_wcl_api.flush_response_cache()
+    if first_error is not None:
+        raise first_error
+    return results
+
+
+def fetch_report_tables(wcl_string, fights, api_key, max_workers=DEFAULT_MAX_WORKERS,
+                        requests_per_second=DEFAULT_REQUESTS_PER_SECOND, checkpoint=None):
+    """
+    Fetches the deaths, damage-done and healing tables for every boss pull of a report in parallel
+
+    With a checkpoint (report_checkpoints.ReportCheckpoint), tables already saved there are
+    not requested again, and each new table is saved as soon as it arrives.
+
+    Returns:
+    (dict): {(fight id, table name): decoded json}
+    """
+    table_requests = report_table_requests(wcl_string, fights, api_key)
+
+    fight_tables = dict()
+    if checkpoint:
+        for fight_id, table_name, _ in table_requests:
+            if checkpoint.has(fight_id, table_name):
+                fight_tables[(fight_id, table_name)] = checkpoint.load(fight_id, table_name)
+    missing_requests = [request for request in table_requests if request[:2] not in fight_tables]
+
+    def save_checkpoint(index, result):
+        fight_id, table_name, _ = missing_requests[index]
+        checkpoint.save(fight_id, table_name, result)
+
+    results = fetch_tables([fightstring for _, _, fightstring in missing_requests],
+                           max_workers, requests_per_second,
+                           on_result=save_checkpoint if checkpoint else None)
+    for (fight_id, table_name, _), result in zip(missing_requests, results):
+        fight_tables[(fight_id, table_name)] = result
+    return fight_tables
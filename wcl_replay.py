@@ -0,0 +1,104 @@
+""" Record and replay of wcl api responses
+
+A Cassette stores every response get_wcl_api receives in a folder, one json file per request
+url, and can later serve them back without any network access. Requests are matched by path
+and query only, with the api_key removed and the query parameters sorted, so recordings made
+with one key replay with any other, and recordings made against warcraftlogs.com replay against
+a local stub and the other way around.
+
+Usage:
+    get_wcl_api.cassette = Cassette('recordings/abcd', mode='record')   # hit wcl (or a stub) and save
+    get_wcl_api.cassette = Cassette('recordings/abcd')                  # replay only
+"""
+
+import hashlib
+import json
+from os import makedirs
+from os.path import isdir, isfile, join
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+
+from raid_compression import atomic_write
+
+CASSETTE_MODES = ('replay', 'record', 'once')
+
+
+def normalize_url(url):
+    """
+    Returns url without its api_key, with the remaining query parameters sorted
+    """
+    parts = urlsplit(url)
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if key != 'api_key')
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ''))
+
+
+def request_key(url):
+    """
+    Returns the path and normalized query of url, which recordings are matched by
+    """
+    parts = urlsplit(normalize_url(url))
+    return urlunsplit(('', '', parts.path, parts.query, ''))
+
+
+class CassetteMiss(KeyError):
+    """Raised in replay mode for a request that was never recorded"""
+
+
+class RecordedResponse():
+    """The parts of a requests.Response that get_wcl_api uses, rebuilt from a recording"""
+
+    def __init__(self, url, status_code, text):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.headers = dict()
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} Error for url: {self.url}', response=self)
+
+
+class Cassette():
+    """A folder of recorded wcl responses
+    Attributes:
+        folder: where the recordings are kept
+        mode: 'replay' serves recordings only, 'record' always requests and saves the response,
+              'once' replays what was recorded and records anything new
+        """
+
+    def __init__(self, folder, mode='replay'):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"unknown cassette mode '{mode}', expected one of {CASSETTE_MODES}")
+        self.folder = folder
+        self.mode = mode
+        if mode != 'replay' and not isdir(folder):
+            makedirs(folder)
+
+    def _path(self, url):
+        return join(self.folder, hashlib.sha1(request_key(url).encode('utf-8')).hexdigest() + '.json')
+
+    def load(self, url):
+        with open(self._path(url), 'r') as open_file:
+            recording = json.load(open_file)
+        return RecordedResponse(url, recording['status'], recording['body'])
+
+    def save(self, url, response):
+        recording = {'url': request_key(url), 'status': response.status_code, 'body': response.text}
+        atomic_write(self._path(url), lambda open_file: json.dump(recording, open_file))
+
+    def get(self, url, fetch):
+        """
+        Returns the response for url, from the recording or from fetch(url) depending on the mode
+        """
+        if self.mode != 'record' and isfile(self._path(url)):
+            return self.load(url)
+        if self.mode == 'replay':
+            raise CassetteMiss(request_key(url))
+        response = fetch(url)
+        self.save(url, response)
+        return response
@@ -0,0 +1,280 @@
+""" A local stand-in for the wcl v1 report api, served from the raid files of a raid folder
+
+WCLStubServer answers /v1/report/fights/<code> and /v1/report/tables/<table>/<code>?start=&end=
+for deaths, damage-done and healing with the responses saved in a raid folder's files, so the
+ingestion path of RaidnightData can be run, profiled and load-tested offline. Responses can be
+delayed, and the server can inject 5xx errors and 429 rate-limit responses, either at random
+(from a seeded generator) or deterministically for the first requests of every url. Data
+responses carry an ETag, and conditional requests for unchanged data are answered with 304.
+
+The parse scrapes of a report come from the wcl website rather than the api; seed_parse_scrapes
+copies them into a report's checkpoints so ingestion does not start a browser.
+
+Usage:
+    python wcl_stub.py MyDudes [-port 8000] [-latency 0.05] [-error-rate 0.1] [-rate-limit 10]
+    WCL_REPORT_URL=http://127.0.0.1:8000/v1/report/ python main.py <code> -dir <empty raid folder>
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from raid_catalog import difficulty_dict, get_catalog
+from raid_sections import load_raid_file
+from report_checkpoints import ReportCheckpoint
+
+ERROR_STATUSES = (500, 502, 503, 504)
+RATE_LIMIT_STATUS = 429
+
+
+class StubReports():
+    """The wcl api responses stored in a raid folder's files, read on first request
+    Attributes:
+        raid_folder: the folder serving as the stub's data
+        """
+
+    def __init__(self, raid_folder):
+        self.raid_folder = raid_folder
+        self._reports = dict()
+        self._lock = threading.Lock()
+
+    def _report(self, code):
+        with self._lock:
+            if code not in self._reports:
+                catalog = get_catalog(self.raid_folder)
+                if not catalog.get(code):
+                    raise KeyError(code)
+                self._reports[code] = load_raid_file(catalog.path(code))
+            return self._reports[code]
+
+    def fights(self, code):
+        return self._report(code)['fights']
+
+    def table(self, table_name, code, start, end):
+        """
+        Returns the saved table of the boss pull of a report between start and end (fight-relative ms)
+        """
+        file_dict = self._report(code)
+        for fight in file_dict['fights']['fights']:
+            if not fight['boss'] or fight['start_time'] != start or fight['end_time'] != end:
+                continue
+            fight_name = ' '.join([difficulty_dict[fight['difficulty']], fight['name']])
+            if table_name == 'deaths':
+                return file_dict['deaths'][' '.join([fight_name, str(fight['id'])])]
+            return file_dict[table_name][fight_name]
+        raise KeyError((table_name, code, start, end))
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        # per-request logging to stderr would dominate load tests
+        pass
+
+    def _send(self, status, body, headers=None):
+        encoded = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(encoded)
+        self.server.stub.count(status)
+
+    def _send_data(self, body):
+        # with an ETag, so conditional requests can be answered with 304
+        etag = '"' + hashlib.sha1(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.server.stub.count(304)
+            return
+        self._send(200, body, {'ETag': etag})
+
+    def do_GET(self):
+        stub = self.server.stub
+        url = urlsplit(self.path)
+        stub.delay()
+
+        if stub.rate_limited():
+            self._send(RATE_LIMIT_STATUS, {'status': RATE_LIMIT_STATUS, 'error': 'Too many requests.'},
+                       {'Retry-After': '1'})
+            return
+        injected_status = stub.injected_error(url.path + '?' + url.query)
+        if injected_status:
+            self._send(injected_status, {'status': injected_status, 'error': 'Injected error.'})
+            return
+
+        parts = url.path.strip('/').split('/')
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            if parts[:3] == ['v1', 'report', 'fights'] and len(parts) == 4:
+                self._send_data(stub.reports.fights(parts[3]))
+            elif (parts[:3] == ['v1', 'report', 'tables'] and len(parts) == 5
+                  and parts[3] in ('deaths', 'damage-done', 'healing')):
+                self._send_data(stub.reports.table(parts[3], parts[4], int(query['start']), int(query['end'])))
+            else:
+                self._send(404, {'status': 404, 'error': 'Unknown endpoint.'})
+        except (KeyError, ValueError):
+            self._send(400, {'status': 400, 'error': 'This report does not exist or is private.'})
+
+
+class WCLStubServer():
+    """A wcl api stub running on a background thread
+
+    Usage:
+        with WCLStubServer('MyDudes', latency=0.05, error_rate=0.1) as stub:
+            get_wcl_api.WCL_REPORT_URL = stub.url
+            ...
+
+    Parameters:
+        raid_folder (str): the folder whose raid files are served
+        latency (float): seconds added to every response
+        jitter (float): up to this many more seconds, drawn at random per response
+        error_rate (float): the fraction of requests answered with one of error_statuses
+        errors_per_url (int): answer the first this many requests of every url with an error,
+            for retry tests that must not depend on request order
+        error_statuses (tuple): the statuses injected errors are drawn from
+        rate_limit (float): requests per second (with a burst of the same size) beyond which 429 is returned
+        seed (int): seeds the generator behind jitter and error_rate
+    """
+
+    def __init__(self, raid_folder, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 errors_per_url=0, error_statuses=ERROR_STATUSES, rate_limit=None, seed=0):
+        self.reports = StubReports(raid_folder)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.errors_per_url = errors_per_url
+        self.error_statuses = tuple(error_statuses)
+        self.rate_limit = rate_limit
+        # {status code: responses sent}
+        self.status_counts = dict()
+
+        self._random = random.Random(seed)
+        self._url_errors = dict()
+        self._tokens = float(rate_limit) if rate_limit else 0.0
+        self._token_time = time.monotonic()
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer((host, port), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1/report/'
+
+    def serve_forever(self):
+        # in the foreground, until interrupted
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, status):
+        with self._lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def delay(self):
+        with self._lock:
+            seconds = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if seconds:
+            time.sleep(seconds)
+
+    def rate_limited(self):
+        # token bucket refilled at rate_limit tokens per second
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.rate_limit), self._tokens + (now - self._token_time)*self.rate_limit)
+            self._token_time = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+    def injected_error(self, request_url):
+        """
+        Returns the error status to answer request_url with, or None to answer normally
+        """
+        with self._lock:
+            if self.errors_per_url:
+                errors_sent = self._url_errors.get(request_url, 0)
+                if errors_sent < self.errors_per_url:
+                    self._url_errors[request_url] = errors_sent + 1
+                    return self.error_statuses[errors_sent % len(self.error_statuses)]
+            if self.error_rate and self._random.random() < self.error_rate:
+                return self._random.choice(self.error_statuses)
+        return None
+
+
+def seed_parse_scrapes(source_folder, raid_folder, code):
+    """
+    Copies the saved parse scrapes of a report into its checkpoints in raid_folder
+
+    RaidnightData then takes them from the checkpoints instead of scraping the wcl website.
+    """
+    file_dict = load_raid_file(get_catalog(source_folder).path(code))
+    checkpoint = ReportCheckpoint(raid_folder, code)
+    for fight in file_dict['fights']['fights']:
+        if not fight['boss'] or not fight['kill']:
+            continue
+        fight_name = ' '.join([difficulty_dict[fight['difficulty']], fight['name']])
+        if fight_name in file_dict['parse-scrapes']:
+            checkpoint.save(fight['id'], 'parse-scrapes', file_dict['parse-scrapes'][fight_name])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the wcl report api from a folder of raid files')
+    parser.add_argument('raid_folder', type=str, help="the directory containing raid json files")
+    parser.add_argument('-host', type=str, default='127.0.0.1')
+    parser.add_argument('-port', type=int, default=8000)
+    parser.add_argument('-latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('-jitter', type=float, default=0.0, help="up to this many more seconds at random")
+    parser.add_argument('-error-rate', type=float, default=0.0,
+                        help="the fraction of requests answered with a 500, 502, 503 or 504")
+    parser.add_argument('-errors-per-url', type=int, default=0,
+                        help="answer the first N requests of every url with an error")
+    parser.add_argument('-rate-limit', type=float,
+                        help="requests per second beyond which 429 is returned")
+    parser.add_argument('-seed', type=int, default=0)
+    parser.add_argument('-seed-parses', type=str, metavar='RAID_FOLDER',
+                        help="copy every report's parse scrapes into the checkpoints of this raid folder first")
+    args = parser.parse_args()
+
+    if args.seed_parses:
+        for code in get_catalog(args.raid_folder).codes():
+            seed_parse_scrapes(args.raid_folder, args.seed_parses, code)
+
+    stub = WCLStubServer(args.raid_folder, args.host, args.port, args.latency, args.jitter, args.error_rate,
+                         args.errors_per_url, rate_limit=args.rate_limit, seed=args.seed)
+    print(f'serving {args.raid_folder} at {stub.url}')
+    stub.serve_forever()
@@ -0,0 +1,125 @@
+""" Lookups against the zones.json and raid-release-dates.json files shipped next to the raid folders
+
+Both files are parsed once per process and indexed into dictionaries; they are only
+re-read when their mtime changes.
+"""
+
+import datetime
+import json
+import threading
+from os import pardir, stat
+from os.path import abspath, join
+
+# the files lockout periods are computed from, in each raid folder's parent
+LOCKOUT_SOURCES = ('zones.json', 'raid-release-dates.json')
+
+_json_cache = dict()
+_registry_cache = dict()
+_cache_lock = threading.Lock()
+
+
+def _load_json(filepath):
+    """
+    Returns (mtime, parsed json) for a file, re-reading it only when its mtime changed
+    """
+    filepath = abspath(filepath)
+    mtime = stat(filepath).st_mtime
+    with _cache_lock:
+        cached = _json_cache.get(filepath)
+        if cached and cached[0] == mtime:
+            return cached
+    with open(filepath, 'r') as open_file:
+        cached = (mtime, json.load(open_file))
+    with _cache_lock:
+        _json_cache[filepath] = cached
+    return cached
+
+
+class ZoneRegistry():
+    """The zones.json data indexed for constant-time lookups
+    Attributes:
+        zone_names: dictionary of form {zone id: zone name}
+        encounter_zones: dictionary of form {encounter id: zone id}
+        encounter_names: dictionary of form {encounter id: encounter name}
+        """
+
+    def __init__(self, zones_list):
+        self.zone_names = dict()
+        self.encounter_zones = dict()
+        self.encounter_names = dict()
+        # the first entry wins for duplicate ids, as with the linear scan this replaces
+        for entry in zones_list:
+            self.zone_names.setdefault(entry['id'], entry['name'])
+            for encounter in entry.get('encounters', []):
+                self.encounter_zones.setdefault(encounter['id'], entry['id'])
+                self.encounter_names.setdefault(encounter['id'], encounter['name'])
+
+
+def lockout_source_mtimes(basedir):
+    """
+    Returns the mtimes of LOCKOUT_SOURCES (None for a missing file), to tell when stored lockouts are stale
+    """
+    mtimes = []
+    for filename in LOCKOUT_SOURCES:
+        try:
+            mtimes.append(stat(join(basedir, pardir, filename)).st_mtime)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+def get_zone_registry(basedir):
+    """
+    Returns the ZoneRegistry for the zones.json in basedir's parent, rebuilt if the file changed
+    """
+    mtime, zones_list = _load_json(join(basedir, pardir, 'zones.json'))
+    key = abspath(join(basedir, pardir, 'zones.json'))
+    with _cache_lock:
+        cached = _registry_cache.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    registry = ZoneRegistry(zones_list)
+    with _cache_lock:
+        _registry_cache[key] = (mtime, registry)
+    return registry
+
+
+def get_zone_name_from_id(zoneid, basedir):
+    return get_zone_registry(basedir).zone_names.get(zoneid, 'unknown')
+
+
+def get_zone_id_from_encounter(encounterid, basedir):
+    """
+    Returns the zone id of a boss encounter (the 'boss' field of a wcl fight), or None
+    """
+    return get_zone_registry(basedir).encounter_zones.get(encounterid)
+
+
+def get_raid_release_date(raid_name, basedir):
+    """
+    Returns the release timestamp of a raid from raid-release-dates.json
+
+    Raises KeyError for raids missing from the file
+    """
+    _, raid_release_timestamps = _load_json(join(basedir, pardir, 'raid-release-dates.json'))
+    return raid_release_timestamps[raid_name]
+
+
+def get_lockout_period(zoneid, raidnight_date, basedir):
+    """
+    Gets the number of weeks between a raid's release and the given date
+
+    0 = first normal/heroic week, 1 = first mythic week
+
+    Parameters:
+    zoneid (int): the wcl zone id of the raid
+    raidnight_date (int): a unix timestamp (seconds)
+    basedir (str): the raid folder; zones.json and raid-release-dates.json live in its parent
+
+    Returns:
+    (int)
+    """
+    raid_release_date = get_raid_release_date(get_zone_name_from_id(zoneid, basedir), basedir)
+    days_since_release = datetime.date.fromtimestamp(
+        raidnight_date) - datetime.date.fromtimestamp(raid_release_date)
+    return days_since_release.days//7